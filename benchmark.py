@@ -0,0 +1,638 @@
+"""Unlight 自動化效能測試
+
+使用方式:
+    python benchmark.py solver            # 求解器延遲（含小手牌的暴力驗證）
+    python benchmark.py recognition       # 合成手牌截圖的識別準確率與吞吐量
+    python benchmark.py recognition --save-baseline bench_baseline.json
+    python benchmark.py recognition --baseline bench_baseline.json
+    python benchmark.py actions           # 逐一點擊與動作序列的執行延遲（乾跑輸入）
+    python benchmark.py sessions --sessions 1 2 4 --workers 1 2 4   # 多開時的回合/秒
+    python benchmark.py replay session.rec --strict   # 回放錄製的對局並比對識別與計畫
+
+不需要顯示環境，可在 Linux 伺服器上執行。與基準比較出現退步時結束碼為 1；
+耗時依同一次執行中參考掃描的耗時換算，基準可以在不同機器上共用。
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import threading
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from unlight_bot import (Card, CardFaces, CardSymbol, DEFAULT_TEMPLATE_SCALES, DigitRecognizer,
+                         FLIP_COST, Frame, FrameSource, HandStateTracker, MultiSessionController,
+                         PLAY_COST, PyramidSymbolMatcher, Rect,
+                         RecordingInputBackend, ReplayFrameSource, SYMBOL_TEMPLATE_FILES,
+                         SessionReplayer, SymbolMatcher, TemplateBank, UnlightBot,
+                         solve_phase_plan)
+
+SYMBOLS = list(CardSymbol)
+
+def random_hand(rng: random.Random, size: int) -> List[Card]:
+    """產生隨機手牌"""
+    cards = []
+    for i in range(size):
+        cards.append(Card(
+            position=(100 + i * 90, 670),
+            center_position=(100 + i * 90, 670),
+            top_symbol=rng.choice(SYMBOLS),
+            top_value=rng.randint(1, 5),
+            bottom_symbol=rng.choice(SYMBOLS),
+            bottom_value=rng.randint(1, 5),
+            current_side=rng.choice(["top", "bottom"])
+        ))
+    return cards
+
+def random_requirements(rng: random.Random) -> List[Tuple[CardSymbol, int]]:
+    """產生隨機階段需求（1~3 個需求，目標 1~10）"""
+    count = rng.randint(1, 3)
+    return [(rng.choice(SYMBOLS), rng.randint(1, 10)) for _ in range(count)]
+
+def plan_key(plans) -> Tuple[int, int, int]:
+    """計畫的優劣鍵（越大越好）：達成數、總和、負成本"""
+    hits = sum(1 for plan in plans if plan.satisfied)
+    total = sum(plan.total for plan in plans)
+    cost = sum(len(plan.plays) * PLAY_COST + plan.flips * FLIP_COST for plan in plans)
+    return hits, total, -cost
+
+def brute_force_key(cards: List[Card], requirements) -> Tuple[int, int, int]:
+    """暴力列舉所有分配，回傳最佳解的優劣鍵"""
+    per_card = []
+    for card in cards:
+        options = [None]
+        for j, (symbol, target) in enumerate(requirements):
+            if card.get_current_symbol() == symbol:
+                options.append((j, card.get_current_value(), False))
+            if card.get_other_symbol() == symbol:
+                options.append((j, card.get_other_value(), True))
+        per_card.append(options)
+
+    best = None
+    for assignment in itertools.product(*per_card):
+        sums = [0] * len(requirements)
+        cost = 0
+        for option in assignment:
+            if option is None:
+                continue
+            j, value, flip = option
+            sums[j] += value
+            cost += PLAY_COST + (FLIP_COST if flip else 0)
+        if any(total > target for total, (_, target) in zip(sums, requirements)):
+            continue
+        hits = sum(1 for total, (_, target) in zip(sums, requirements) if total == target)
+        key = (hits, sum(sums), -cost)
+        if best is None or key > best:
+            best = key
+    return best
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q)) * 1000
+
+def bench_solver(hand_sizes: List[int], rounds: int, seed: int, verify_up_to: int):
+    """測量求解器延遲，並以暴力列舉驗證小手牌的最佳性"""
+    rng = random.Random(seed)
+    print(f"{'手牌數':>6} {'平均(ms)':>10} {'p95(ms)':>10} {'最大(ms)':>10} {'驗證':>8}")
+    for size in hand_sizes:
+        samples = []
+        mismatches = 0
+        verified = 0
+        for _ in range(rounds):
+            cards = random_hand(rng, size)
+            requirements = random_requirements(rng)
+            start = time.perf_counter()
+            plans = solve_phase_plan(cards, requirements)
+            samples.append(time.perf_counter() - start)
+
+            if size <= verify_up_to:
+                verified += 1
+                if plan_key(plans) != brute_force_key(cards, requirements):
+                    mismatches += 1
+
+        check = f"{verified - mismatches}/{verified}" if verified else "-"
+        print(f"{size:>6} {np.mean(samples) * 1000:>10.3f} {percentile_ms(samples, 95):>10.3f} "
+              f"{max(samples) * 1000:>10.3f} {check:>8}")
+        if mismatches:
+            print(f"  警告: {mismatches} 組結果與暴力解不同")
+
+def draw_symbol(symbol: CardSymbol, size: int = 16) -> np.ndarray:
+    """繪製合成用的符號模板（白底黑圖形）"""
+    canvas = np.full((size, size), 235, dtype=np.uint8)
+    c = size // 2
+    if symbol == CardSymbol.MOVE:
+        points = np.array([[2, c - 3], [c, c - 3], [c, 1], [size - 2, c], [c, size - 2], [c, c + 3], [2, c + 3]])
+        cv2.fillPoly(canvas, [points], 30)
+    elif symbol == CardSymbol.SHIELD:
+        points = np.array([[2, 2], [size - 3, 2], [size - 3, c], [c, size - 2], [2, c]])
+        cv2.fillPoly(canvas, [points], 30)
+    elif symbol == CardSymbol.SWORD:
+        cv2.line(canvas, (2, size - 3), (size - 3, 2), 30, 2)
+        cv2.line(canvas, (3, c + 2), (c - 2, size - 4), 30, 2)
+    elif symbol == CardSymbol.GUN:
+        cv2.rectangle(canvas, (1, 3), (size - 2, 7), 30, -1)
+        cv2.rectangle(canvas, (size - 7, 3), (size - 3, size - 3), 30, -1)
+    else:
+        cv2.circle(canvas, (c, c), c - 2, 30, 2)
+        cv2.circle(canvas, (c, c), 2, 30, -1)
+    return canvas
+
+def make_symbol_templates(directory: str):
+    """將合成符號模板寫入資料夾（檔名與 SYMBOL_TEMPLATE_FILES 相同）"""
+    for symbol, filename in SYMBOL_TEMPLATE_FILES.items():
+        cv2.imwrite(os.path.join(directory, filename), draw_symbol(symbol))
+
+class SyntheticHandGenerator:
+    """依照 UnlightBot 的手牌區域產生帶標籤的合成截圖
+
+    每張卡牌的上半部與（旋轉 180 度的）下半部各畫一個符號與數值，
+    並加入縮放、亮度與雜訊擾動。layout_jitter 不為 0 時每張截圖的卡牌大小、
+    間距與手牌在區域內的位置也會隨機改變。
+    """
+    def __init__(self, bot: UnlightBot, template_dir: str,
+                 screen_size: Tuple[int, int] = (1280, 800),
+                 noise: float = 6.0, scale_jitter: float = 0.0,
+                 brightness_jitter: float = 20.0, max_value: int = 9,
+                 layout_jitter: float = 0.0):
+        self.hand_area = bot.hand_area
+        self.card_size = bot.card_size
+        self.card_spacing = bot.card_spacing
+        self.screen_size = screen_size
+        self.noise = noise
+        self.scale_jitter = scale_jitter
+        self.brightness_jitter = brightness_jitter
+        self.max_value = max_value
+        self.layout_jitter = layout_jitter
+        self.templates = {symbol: cv2.imread(os.path.join(template_dir, filename), cv2.IMREAD_GRAYSCALE)
+                          for symbol, filename in SYMBOL_TEMPLATE_FILES.items()}
+
+    def _draw_face(self, rng: random.Random, symbol: CardSymbol, value: int,
+                   width: int, height: int) -> np.ndarray:
+        face = np.full((height, width), 235, dtype=np.uint8)
+        template = self.templates[symbol]
+        scale = 1.0 + rng.uniform(-self.scale_jitter, self.scale_jitter)
+        if scale != 1.0:
+            template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        t_height, t_width = template.shape[:2]
+        top = max(0, (height - t_height) // 2)
+        face[top:top + t_height, 6:6 + t_width] = template[:height - top, :width - 6]
+        cv2.putText(face, str(value), (40, height - 7), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6 * scale, 30, 2)
+        return face
+
+    def random_faces(self, rng: random.Random) -> CardFaces:
+        return (rng.choice(SYMBOLS), rng.randint(1, self.max_value),
+                rng.choice(SYMBOLS), rng.randint(1, self.max_value))
+
+    def random_layout(self, rng: random.Random, card_count: int) -> Tuple[float, int, int, int]:
+        """隨機的 (卡牌縮放, 間距, x 偏移, y 偏移)，所有卡牌都會在手牌區域內"""
+        card_width, card_height = self.card_size
+        if not self.layout_jitter:
+            return 1.0, self.card_spacing, 0, 10
+        scale = 1.0 + rng.uniform(-self.layout_jitter, self.layout_jitter)
+        width, height = round(card_width * scale), round(card_height * scale)
+        # 卡牌間隙隨視窗縮放，再隨機加寬最多一倍（間隙小於約 8 像素時定位器會把相鄰卡牌連成一張）
+        gap = round((self.card_spacing - card_width) * scale)
+        spacing = width + rng.randint(gap, gap * 2)
+        _, _, area_width, area_height = self.hand_area
+        x_offset = rng.randint(0, max(0, area_width - (card_count - 1) * spacing - width))
+        y_offset = rng.randint(0, max(0, area_height - height))
+        return scale, spacing, x_offset, y_offset
+
+    def generate(self, rng: random.Random, card_count: int) -> Tuple[np.ndarray, List[CardFaces]]:
+        """產生一張截圖與每張卡牌的標籤"""
+        labels = [self.random_faces(rng) for _ in range(card_count)]
+        return self.render(rng, labels, layout=self.random_layout(rng, card_count)), labels
+
+    def render(self, rng: random.Random, labels: List[CardFaces], stable: bool = False,
+               layout: Optional[Tuple[float, int, int, int]] = None) -> np.ndarray:
+        """依照標籤與 random_layout 的版面產生截圖（預設為 UnlightBot 的固定版面）
+
+        stable 為 True 時擾動只由卡牌位置與內容決定、雜訊固定，
+        同一位置的同一張卡牌在連續畫面中像素完全相同（模擬實際遊戲畫面）。
+        """
+        width, height = self.screen_size
+        screen = np.full((height, width), 50, dtype=np.uint8)
+        card_width, card_height = self.card_size
+        quarter = card_height // 4
+        scale, spacing, x_offset, y_offset = layout or (1.0, self.card_spacing, 0, 10)
+        x, y = self.hand_area[0] + x_offset, self.hand_area[1] + y_offset
+
+        for i, faces in enumerate(labels):
+            card_rng = random.Random(repr((i, faces))) if stable else rng
+            card = np.full((card_height, card_width), 235, dtype=np.uint8)
+            cv2.rectangle(card, (0, 0), (card_width - 1, card_height - 1), 60, 2)
+            card[quarter:card_height // 2] = self._draw_face(card_rng, faces[0], faces[1], card_width, card_height // 2 - quarter)
+            bottom = self._draw_face(card_rng, faces[2], faces[3], card_width, card_height - quarter - card_height // 2)
+            card[card_height // 2:card_height - quarter] = cv2.rotate(bottom, cv2.ROTATE_180)
+
+            gain = 1.0 + card_rng.uniform(-self.brightness_jitter, self.brightness_jitter) / 255
+            offset = card_rng.uniform(-self.brightness_jitter, self.brightness_jitter)
+            card = np.clip(card.astype(np.float32) * gain + offset, 0, 255).astype(np.uint8)
+            if scale != 1.0:
+                card = cv2.resize(card, (round(card_width * scale), round(card_height * scale)),
+                                  interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+            card_x = x + i * spacing
+            screen[y:y + card.shape[0], card_x:card_x + card.shape[1]] = card
+
+        noise_seed = 0 if stable else rng.randrange(1 << 30)
+        noise = np.random.default_rng(noise_seed).normal(0, self.noise, screen.shape)
+        screen = np.clip(screen.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+        return cv2.cvtColor(screen, cv2.COLOR_GRAY2BGR)
+
+def cached_sequence(generator: SyntheticHandGenerator, rng: random.Random, frames: int,
+                    run_length: int = 20, stable: bool = True) -> Tuple[List[np.ndarray], List[List[CardFaces]]]:
+    """產生連續對局畫面：每段手牌數與版面固定，每張畫面有一半機率換掉一張卡牌
+
+    換牌時一半只改數值（符號不變），用來檢查快取與手牌追蹤是否會把
+    不同數值的卡牌當成同一張。stable 為 False 時每張畫面重新加入雜訊與亮度擾動。
+    """
+    images = []
+    labels = []
+    hand: List[CardFaces] = []
+    layout = None
+    for index in range(frames):
+        if index % run_length == 0:
+            hand = [generator.random_faces(rng) for _ in range(rng.randint(1, 6))]
+            layout = generator.random_layout(rng, len(hand))
+        elif rng.random() < 0.5:
+            slot = rng.randrange(len(hand))
+            faces = generator.random_faces(rng)
+            if rng.random() < 0.5:
+                old = hand[slot]
+                faces = (old[0], faces[1], old[2], faces[3])
+            hand = hand[:slot] + [faces] + hand[slot + 1:]
+        images.append(generator.render(rng, hand, stable=stable, layout=layout))
+        labels.append(hand)
+    return images, labels
+
+def score_cards(cards: List[Card], hand: List[CardFaces]) -> Tuple[int, int, int]:
+    """回傳 (符號正確數, 數值正確數, 卡牌正確數)"""
+    symbol_correct = value_correct = card_correct = 0
+    for card, expected in zip(cards, hand):
+        recognized = (card.top_symbol, card.top_value, card.bottom_symbol, card.bottom_value)
+        symbol_correct += (recognized[0] == expected[0]) + (recognized[2] == expected[2])
+        value_correct += (recognized[1] == expected[1]) + (recognized[3] == expected[3])
+        card_correct += recognized == expected
+    return symbol_correct, value_correct, card_correct
+
+def bench_recognition(frames: int, seed: int, noise: float, scale_jitter: float,
+                      template_dir: Optional[str], exact_matching: bool = False,
+                      layout_jitter: float = 0.0) -> Dict[str, float]:
+    """以合成截圖測量識別準確率、吞吐量與求解延遲
+
+    另外以原始解析度的 SymbolMatcher 掃描同一批畫面作為參考
+    （reference_ms_per_card），與基準比較時耗時會依參考耗時換算，
+    因此基準可以在不同速度的機器上使用。
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as temp_dir, contextlib.redirect_stdout(io.StringIO()):
+        if template_dir is None:
+            make_symbol_templates(temp_dir)
+            template_dir = temp_dir
+
+        probe = UnlightBot(ReplayFrameSource([np.zeros((800, 1280, 3), dtype=np.uint8)]))
+        generator = SyntheticHandGenerator(probe, template_dir, noise=noise, scale_jitter=scale_jitter,
+                                           layout_jitter=layout_jitter)
+        images = []
+        labels = []
+        for _ in range(frames):
+            image, hand = generator.generate(rng, rng.randint(1, 6))
+            images.append(image)
+            labels.append(hand)
+
+        bot = UnlightBot(ReplayFrameSource(images))
+        bot.template_bank = TemplateBank(template_dir, scales=DEFAULT_TEMPLATE_SCALES)
+        matcher = SymbolMatcher if exact_matching else PyramidSymbolMatcher
+        bot.symbol_matcher = matcher(bot.template_bank)
+        bot.digit_recognizer = DigitRecognizer(use_tesseract=False)
+
+        symbol_matcher = bot.symbol_matcher
+        reference_matcher = SymbolMatcher(bot.template_bank)
+
+        symbol_correct = value_correct = card_correct = card_total = count_correct = 0
+        scan_times = []
+        reference_times = []
+        solve_times = []
+        for hand in labels:
+            frame = bot.grab_frame()
+            # 參考：以原始解析度比對所有模板掃描同一張畫面，與受測的掃描交錯執行，
+            # 兩者經歷相同的機器負載
+            bot.symbol_matcher = reference_matcher
+            bot.recognition_cache.clear()
+            start = time.perf_counter()
+            bot.scan_hand_cards(frame)
+            reference_times.append(time.perf_counter() - start)
+
+            bot.symbol_matcher = symbol_matcher
+            bot.recognition_cache.clear()  # 測量完整識別，不使用快取
+            start = time.perf_counter()
+            cards = bot.scan_hand_cards(frame)
+            scan_times.append(time.perf_counter() - start)
+
+            count_correct += len(cards) == len(hand)
+            symbols, values, correct = score_cards(cards, hand)
+            symbol_correct += symbols
+            value_correct += values
+            card_correct += correct
+            card_total += len(hand)
+
+            requirements = bot.phase_requirements.get(bot.current_phase, [(CardSymbol.MOVE, 3)])
+            start = time.perf_counter()
+            solve_phase_plan(cards, requirements)
+            solve_times.append(time.perf_counter() - start)
+
+        # 重新掃描同一張畫面（快取命中）
+        frame = ReplayFrameSource(images[:1]).grab(bot.capture_rois())
+        bot.scan_hand_cards(frame)
+        cached_times = []
+        for _ in range(50):
+            start = time.perf_counter()
+            bot.scan_hand_cards(frame)
+            cached_times.append(time.perf_counter() - start)
+        cached_ms = float(np.median(cached_times)) * 1000
+
+        # 啟用快取的連續畫面：快取不可讓換過的卡牌沿用舊結果
+        sequence_images, sequence_labels = cached_sequence(generator, rng, frames)
+        bot.frame_source = ReplayFrameSource(sequence_images)
+        bot.recognition_cache.clear()
+        hits_before = bot.recognition_cache.hits
+        lookups_before = hits_before + bot.recognition_cache.misses
+        cached_correct = cached_total = 0
+        sequence_times = []
+        for hand in sequence_labels:
+            frame = bot.grab_frame()
+            start = time.perf_counter()
+            cards = bot.scan_hand_cards(frame)
+            sequence_times.append(time.perf_counter() - start)
+            cached_correct += score_cards(cards, hand)[2]
+            cached_total += len(hand)
+        cache_hits = bot.recognition_cache.hits - hits_before
+        cache_lookups = bot.recognition_cache.hits + bot.recognition_cache.misses - lookups_before
+
+        # 手牌追蹤：數量不變但卡牌被換掉時，抽查必須發現並重新識別
+        sequence_images, sequence_labels = cached_sequence(generator, rng, frames, stable=False)
+        bot.frame_source = ReplayFrameSource(sequence_images)
+        bot.recognition_cache.clear()
+        tracker = HandStateTracker(bot)
+        tracked_correct = tracked_total = 0
+        for hand in sequence_labels:
+            cards = tracker.sync(bot.grab_frame())
+            tracked_correct += score_cards(cards, hand)[2]
+            tracked_total += len(hand)
+
+    total_scan = sum(scan_times)
+    reference_ms_per_card = sum(reference_times) / card_total * 1000
+    return {
+        "frames": frames,
+        "cards": card_total,
+        "hand_count_accuracy": count_correct / frames,
+        "symbol_accuracy": symbol_correct / (2 * card_total),
+        "value_accuracy": value_correct / (2 * card_total),
+        "card_accuracy": card_correct / card_total,
+        "frames_per_sec": frames / total_scan,
+        "ms_per_card": total_scan / card_total * 1000,
+        "scan_p95_ms": percentile_ms(scan_times, 95),
+        "reference_ms_per_card": reference_ms_per_card,
+        "scan_speedup": reference_ms_per_card / (total_scan / card_total * 1000),
+        "cached_scan_ms": cached_ms,
+        "cached_sequence_ms": float(np.mean(sequence_times)) * 1000,
+        "cached_card_accuracy": cached_correct / cached_total,
+        "cache_hit_rate": cache_hits / max(1, cache_lookups),
+        "tracked_card_accuracy": tracked_correct / tracked_total,
+        "tracked_verify_rate": tracker.verified_syncs / frames,
+        "solve_p95_ms": percentile_ms(solve_times, 95),
+    }
+
+# 與基準比較時允許的變化：準確率最多下降多少、耗時最多增加幾倍
+# （耗時先依兩次執行的 reference_ms_per_card 換算成同一台機器的速度再比較，
+# 換算後的小耗時指標在同一台機器上仍會相差約四成）
+ACCURACY_TOLERANCE = 0.01
+LATENCY_TOLERANCE = 1.5
+LOWER_IS_BETTER = {"ms_per_card", "scan_p95_ms", "cached_scan_ms", "cached_sequence_ms", "solve_p95_ms"}
+HIGHER_IS_BETTER = {"frames_per_sec"}
+RATIOS = {"scan_speedup"}  # 與機器速度無關的耗時比值
+RATES = {"cache_hit_rate", "tracked_verify_rate"}  # 固定種子時不隨機器改變，與準確率相同方式比較
+
+def find_regressions(results: Dict[str, float], baseline: Dict[str, float]) -> List[str]:
+    """列出相對基準退步的指標"""
+    # 這台機器相對於產生基準的機器慢了幾倍
+    machine_factor = 1.0
+    if baseline.get("reference_ms_per_card") and results.get("reference_ms_per_card"):
+        machine_factor = results["reference_ms_per_card"] / baseline["reference_ms_per_card"]
+
+    regressions = []
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        expected = baseline[key]
+        if (key.endswith("accuracy") or key in RATES) and value < expected - ACCURACY_TOLERANCE:
+            regressions.append(f"{key}: {value:.3f} < 基準 {expected:.3f}")
+        elif key in RATIOS and value * LATENCY_TOLERANCE < expected:
+            regressions.append(f"{key}: {value:.3f} < 基準 {expected:.3f}")
+        elif key in HIGHER_IS_BETTER and value * LATENCY_TOLERANCE < expected / machine_factor:
+            regressions.append(f"{key}: {value:.1f} < 換算後基準 {expected / machine_factor:.1f}")
+        elif key in LOWER_IS_BETTER and value > expected * machine_factor * LATENCY_TOLERANCE:
+            regressions.append(f"{key}: {value:.3f} > 換算後基準 {expected * machine_factor:.3f}")
+    return regressions
+
+class SimulatedTable(FrameSource):
+    """回應點擊的合成畫面 - 點擊卡牌後經過 reaction 秒，該卡牌區域反相（模擬遊戲動畫）"""
+    def __init__(self, cards: List[Card], card_size: Tuple[int, int],
+                 screen_size: Tuple[int, int] = (1280, 800), reaction: float = 0.05):
+        width, height = screen_size
+        self.image = np.full((height, width, 3), 50, dtype=np.uint8)
+        card_width, card_height = card_size
+        self.card_rects = [(card.position[0] - card_width // 2, card.position[1] - card_height // 2,
+                            card_width, card_height) for card in cards]
+        for x, y, w, h in self.card_rects:
+            self.image[y:y + h, x:x + w] = 235
+        self.reaction = reaction
+        self._pending: List[Tuple[float, Rect]] = []
+        self._lock = threading.Lock()
+
+    def size(self) -> Tuple[int, int]:
+        return self.image.shape[1], self.image.shape[0]
+
+    def click(self, x: int, y: int):
+        for rect in self.card_rects:
+            if rect[0] <= x < rect[0] + rect[2] and rect[1] <= y < rect[1] + rect[3]:
+                with self._lock:
+                    self._pending.append((time.perf_counter() + self.reaction, rect))
+
+    def grab(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        now = time.perf_counter()
+        with self._lock:
+            due = [rect for when, rect in self._pending if when <= now]
+            self._pending = [(when, rect) for when, rect in self._pending if when > now]
+            for x, y, w, h in due:
+                self.image[y:y + h, x:x + w] = 255 - self.image[y:y + h, x:x + w]
+            return Frame.full(self.image.copy())
+
+def bench_actions(rounds: int, seed: int, reaction: float, event_interval: float):
+    """比較逐一點擊確認與動作序列的每回合執行時間（乾跑輸入後端）"""
+    print(f"{'模式':>6} {'平均 ms':>10} {'p95 ms':>10} {'點擊/回合':>10} {'點擊間隔 ms':>12}")
+    for batched in (False, True):
+        rng = random.Random(seed)
+        samples = []
+        clicks = 0
+        intervals = []
+        for _ in range(rounds):
+            cards = random_hand(rng, 6)
+            plans = solve_phase_plan(cards, random_requirements(rng))
+            table = SimulatedTable(cards, (80, 120), reaction=reaction)
+            backend = RecordingInputBackend(on_click=table.click)
+            with contextlib.redirect_stdout(io.StringIO()):
+                bot = UnlightBot(table, input_backend=backend)
+                bot.cards = cards
+                bot.batch_actions = batched
+                bot.action_executor.event_interval = event_interval
+                start = time.perf_counter()
+                bot.execute_plans(plans)
+                samples.append(time.perf_counter() - start)
+            clicks += len(backend.events)
+            intervals.extend(backend.intervals())
+
+        mode = "序列" if batched else "逐一"
+        gap = np.mean(intervals) * 1000 if intervals else 0.0
+        print(f"{mode:>6} {np.mean(samples) * 1000:>10.1f} {percentile_ms(samples, 95):>10.1f} "
+              f"{clicks / rounds:>10.2f} {gap:>12.1f}")
+
+def bench_sessions(session_counts: List[int], worker_counts: List[int], frames: int, seed: int,
+                   template_dir: Optional[str]):
+    """多開吞吐量：每個工作階段回放相同的合成截圖，測量所有工作階段合計的回合/秒
+
+    每回合仍會擷取、識別手牌、檢測階段、規劃並送出點擊，但點擊為乾跑且
+    不等待畫面確認（回放的畫面不會因點擊改變，等待只會測到逾時），
+    因此回合完全受 CPU 限制，數字反映多開與執行緒數在這台機器核心數下的擴展。
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if template_dir is None:
+            make_symbol_templates(temp_dir)
+            template_dir = temp_dir
+        with contextlib.redirect_stdout(io.StringIO()):
+            probe = UnlightBot(ReplayFrameSource([np.zeros((800, 1280, 3), dtype=np.uint8)]))
+        generator = SyntheticHandGenerator(probe, template_dir)
+        images = [generator.generate(rng, rng.randint(1, 6))[0] for _ in range(frames)]
+        template_bank = TemplateBank(template_dir, scales=DEFAULT_TEMPLATE_SCALES)
+        symbol_matcher = PyramidSymbolMatcher(template_bank)
+        digit_recognizer = DigitRecognizer(use_tesseract=False)
+
+        print(f"CPU 核心數: {os.cpu_count()}")
+        print(f"{'工作階段':>8} {'執行緒':>6} {'回合/秒':>10} {'每階段回合/秒':>14} {'相對單開':>10} {'確認等待':>8}")
+        for workers in worker_counts:
+            single_rate = None
+            for sessions in session_counts:
+                controller = MultiSessionController(workers=workers, turn_interval=0.0,
+                                                    input_backend=RecordingInputBackend(realtime=False))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for index in range(sessions):
+                        bot = controller.add_session(f"s{index}", frame_source=ReplayFrameSource(images)).bot
+                        bot.template_bank = template_bank
+                        bot.symbol_matcher = symbol_matcher
+                        bot.digit_recognizer = digit_recognizer
+                        bot.action_executor.timeout = 0.0
+                        bot.action_executor.retries = 0
+                    start = time.perf_counter()
+                    controller.run()
+                    elapsed = time.perf_counter() - start
+
+                rate = sum(session.ticks for session in controller.sessions) / elapsed
+                if single_rate is None:
+                    single_rate = rate / sessions
+                # 確認等待佔所有工作階段回合時間的比例（應接近 0）
+                tick_ms = confirm_ms = 0.0
+                for session in controller.sessions:
+                    summary = session.bot.metrics.summary()
+                    tick_ms += summary.get("tick", {}).get("total_ms", 0.0)
+                    confirm_ms += sum(summary.get(stage, {}).get("total_ms", 0.0)
+                                      for stage in ("confirm_wait", "confirm_timeout"))
+                print(f"{sessions:>8} {workers:>6} {rate:>10.1f} {rate / sessions:>14.1f} "
+                      f"{rate / single_rate:>9.2f}x {confirm_ms / max(tick_ms, 1e-9):>8.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Unlight 自動化效能測試")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    solver = subparsers.add_parser("solver", help="求解器延遲")
+    solver.add_argument("--sizes", type=int, nargs="+", default=[6, 8, 12, 20, 40, 80])
+    solver.add_argument("--rounds", type=int, default=200)
+    solver.add_argument("--seed", type=int, default=0)
+    solver.add_argument("--verify-up-to", type=int, default=6,
+                        help="手牌數不超過此值時以暴力列舉驗證")
+
+    recognition = subparsers.add_parser("recognition", help="合成截圖的識別準確率與吞吐量")
+    recognition.add_argument("--frames", type=int, default=200)
+    recognition.add_argument("--seed", type=int, default=0)
+    recognition.add_argument("--noise", type=float, default=6.0, help="高斯雜訊標準差")
+    recognition.add_argument("--scale-jitter", type=float, default=0.0, help="符號縮放擾動比例")
+    recognition.add_argument("--templates", help="符號模板資料夾（預設使用合成模板）")
+    recognition.add_argument("--layout-jitter", type=float, default=0.1,
+                             help="卡牌大小的擾動比例（同時隨機改變間距與手牌位置，0 為固定版面）")
+    recognition.add_argument("--exact-matching", action="store_true",
+                             help="以原始解析度比對所有模板（不使用由粗到細的匹配）")
+    recognition.add_argument("--baseline", help="與此基準 JSON 比較，退步時結束碼為 1")
+    recognition.add_argument("--save-baseline", help="將結果存為基準 JSON")
+
+    actions = subparsers.add_parser("actions", help="逐一點擊與動作序列的執行延遲")
+    actions.add_argument("--rounds", type=int, default=50)
+    actions.add_argument("--seed", type=int, default=0)
+    actions.add_argument("--reaction", type=float, default=0.05, help="模擬遊戲對點擊的反應時間（秒）")
+    actions.add_argument("--event-interval", type=float, default=0.03, help="動作序列中的點擊間隔（秒）")
+
+    replay = subparsers.add_parser("replay", help="回放錄製的對局（run_auto_play 的 record_path）")
+    replay.add_argument("recording", help="錄製檔路徑")
+    replay.add_argument("--strict", action="store_true", help="識別或計畫與錄製時不同時結束碼為 1")
+
+    sessions = subparsers.add_parser("sessions", help="多開時回合/秒與工作階段數、執行緒數的關係")
+    sessions.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4])
+    sessions.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    sessions.add_argument("--frames", type=int, default=60, help="每個工作階段回放的畫面數")
+    sessions.add_argument("--seed", type=int, default=0)
+    sessions.add_argument("--templates", help="符號模板資料夾（預設使用合成模板）")
+
+    args = parser.parse_args()
+    if args.command == "solver":
+        bench_solver(args.sizes, args.rounds, args.seed, args.verify_up_to)
+    elif args.command == "actions":
+        bench_actions(args.rounds, args.seed, args.reaction, args.event_interval)
+    elif args.command == "sessions":
+        bench_sessions(args.sessions, args.workers, args.frames, args.seed, args.templates)
+    elif args.command == "replay":
+        results = SessionReplayer(args.recording).run()
+        for key, value in results.items():
+            print(f"{key:>22}: {value:.4f}" if isinstance(value, float) else f"{key:>22}: {value}")
+        if args.strict and (results["card_mismatches"] or results["plan_mismatches"]):
+            sys.exit(1)
+    elif args.command == "recognition":
+        results = bench_recognition(args.frames, args.seed, args.noise, args.scale_jitter,
+                                    args.templates, args.exact_matching, args.layout_jitter)
+        for key, value in results.items():
+            print(f"{key:>20}: {value:.4f}" if isinstance(value, float) else f"{key:>20}: {value}")
+
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"已儲存基準: {args.save_baseline}")
+
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = find_regressions(results, baseline)
+            if regressions:
+                print("效能退步:")
+                for line in regressions:
+                    print(f"  {line}")
+                sys.exit(1)
+            print("與基準相比沒有退步")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,55 @@
-import cv2
-import numpy as np
-import pyautogui
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import hashlib
+import importlib
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
 import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, Iterator, List, Dict, Tuple, Optional, Union
 from enum import Enum
 
+class LazyModule:
+    """延遲匯入的模組 - 第一次存取屬性時才真正匯入
+
+    匯入後以真正的模組取代本模組中的同名全域變數，之後的存取沒有額外成本；
+    只用到控制指令等輕量功能時不需要載入 OpenCV 與 numpy。
+    """
+    def __init__(self, name: str, alias: str):
+        self._name = name
+        self._alias = alias
+    
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+cv2 = LazyModule("cv2", "cv2")
+np = LazyModule("numpy", "np")
+cProfile = LazyModule("cProfile", "cProfile")  # 只在分析單一回合時使用
+pstats = LazyModule("pstats", "pstats")
+pytesseract = LazyModule("pytesseract", "pytesseract")  # 可選，只在數字識別信心不足時使用
+
+# 第一次需要時才由 require_pyautogui() 載入（無顯示環境時無法載入，只能使用回放畫面來源）
+pyautogui = None
+_pyautogui_error: Optional[str] = None
+
+Rect = Tuple[int, int, int, int]  # (x, y, width, height)
+
 class CardSymbol(Enum):
     MOVE = "移動"
     SHIELD = "盾牌"
@@ -29,82 +73,2140 @@ class Card:
     bottom_symbol: CardSymbol
     bottom_value: int
     current_side: str = "top"  # "top" 或 "bottom"
+    size: Optional[Tuple[int, int]] = None  # 定位到的卡牌尺寸 (寬, 高)
+    confidence: float = 1.0  # 識別信心，低於數字識別器的 min_confidence 時內容可能有誤
     
     def get_current_symbol(self) -> CardSymbol:
         return self.top_symbol if self.current_side == "top" else self.bottom_symbol
     
     def get_current_value(self) -> int:
         return self.top_value if self.current_side == "top" else self.bottom_value
+    
+    def get_other_symbol(self) -> CardSymbol:
+        """翻面後的符號"""
+        return self.bottom_symbol if self.current_side == "top" else self.top_symbol
+    
+    def get_other_value(self) -> int:
+        """翻面後的數值"""
+        return self.bottom_value if self.current_side == "top" else self.top_value
+    
+    def to_dict(self) -> dict:
+        """轉換為可寫入 JSON 的字典"""
+        return {
+            "position": list(self.position),
+            "center_position": list(self.center_position),
+            "top_symbol": self.top_symbol.name,
+            "top_value": self.top_value,
+            "bottom_symbol": self.bottom_symbol.name,
+            "bottom_value": self.bottom_value,
+            "current_side": self.current_side,
+            "size": list(self.size) if self.size else None,
+            "confidence": self.confidence,
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "Card":
+        return cls(
+            position=tuple(data["position"]),
+            center_position=tuple(data["center_position"]),
+            top_symbol=CardSymbol[data["top_symbol"]],
+            top_value=data["top_value"],
+            bottom_symbol=CardSymbol[data["bottom_symbol"]],
+            bottom_value=data["bottom_value"],
+            current_side=data["current_side"],
+            size=tuple(data["size"]) if data.get("size") else None,
+            confidence=data.get("confidence", 1.0),
+        )
+
+@dataclass
+class PlannedPlay:
+    """計畫中的一次出牌"""
+    card: Card
+    flip: bool  # 出牌前是否需要翻面
+    value: int  # 出牌時的數值
+
+@dataclass
+class RequirementPlan:
+    """單一需求的出牌計畫"""
+    symbol: CardSymbol
+    target: int
+    plays: List[PlannedPlay]
+    
+    @property
+    def total(self) -> int:
+        return sum(play.value for play in self.plays)
+    
+    @property
+    def satisfied(self) -> bool:
+        return self.total == self.target
+    
+    @property
+    def flips(self) -> int:
+        return sum(1 for play in self.plays if play.flip)
+
+# 求解成本：翻面優先於點擊次數
+FLIP_COST = 1000
+PLAY_COST = 1
+# 狀態數超過此上限時改為逐一求解每個需求
+MAX_SOLVER_STATES = 1_000_000
+
+def solve_phase_plan(cards: List[Card],
+                     requirements: List[Tuple[CardSymbol, int]]) -> List[RequirementPlan]:
+    """為一個階段的所有需求共同分配卡牌（精確最佳解）
+
+    每張卡牌可以不出、或以目前面/翻面後的一面分配給某個需求，
+    同一張卡牌最多只會分配一次。以多維背包動態規劃求解，狀態為
+    各需求目前的總和（不超過目標值與手牌湊得到的總和）。目標依序為：
+    達成的需求數最多 → 總和最大 → 翻面最少 → 點擊最少。
+    """
+    if not requirements:
+        return []
+    
+    targets = [max(0, value) for _, value in requirements]
+    # 狀態只需涵蓋實際湊得到的總和：每張卡牌最多貢獻符合符號的較大一面，
+    # 目標超過此上限時不可能達成，表格大小與設定的目標值無關
+    limits = []
+    for (symbol, _), target in zip(requirements, targets):
+        reachable_sum = 0
+        for card in cards:
+            faces = ((card.top_symbol, card.top_value), (card.bottom_symbol, card.bottom_value))
+            reachable_sum += max([value for face_symbol, value in faces if face_symbol == symbol and value > 0],
+                                 default=0)
+        limits.append(min(target, reachable_sum))
+    if len(requirements) == 1:
+        # 單一需求無法再拆分，超過上限時只求不超過上限的最大總和
+        limits[0] = min(limits[0], MAX_SOLVER_STATES - 1)
+    dims = tuple(limit + 1 for limit in limits)
+    state_count = int(np.prod(dims))
+    if state_count > MAX_SOLVER_STATES and len(requirements) > 1:
+        # 狀態太多時逐一求解，已使用的卡牌不再分配
+        plans = []
+        remaining = list(cards)
+        for requirement in requirements:
+            plan = solve_phase_plan(remaining, [requirement])[0]
+            used = {id(play.card) for play in plan.plays}
+            remaining = [card for card in remaining if id(card) not in used]
+            plans.append(plan)
+        return plans
+    
+    # 每張卡牌的選項：(需求索引, 數值, 是否翻面)
+    options_per_card = []
+    for card in cards:
+        options = []
+        for j, (symbol, _) in enumerate(requirements):
+            faces = [(card.get_current_symbol(), card.get_current_value(), False),
+                     (card.get_other_symbol(), card.get_other_value(), True)]
+            for face_symbol, value, flip in faces:
+                if face_symbol == symbol and 0 < value <= limits[j]:
+                    options.append((j, value, flip))
+        options_per_card.append(options)
+    
+    inf = np.iinfo(np.int64).max // 4
+    dp = np.full(dims, inf, dtype=np.int64)
+    dp[(0,) * len(dims)] = 0
+    choices = []  # 每張卡牌在各狀態選擇的選項（-1 表示不出）
+    
+    for options in options_per_card:
+        new_dp = dp.copy()
+        choice = np.full(dims, -1, dtype=np.int16)
+        for index, (j, value, flip) in enumerate(options):
+            cost = PLAY_COST + (FLIP_COST if flip else 0)
+            source = [slice(None)] * len(dims)
+            dest = [slice(None)] * len(dims)
+            source[j] = slice(0, dims[j] - value)
+            dest[j] = slice(value, dims[j])
+            candidate = dp[tuple(source)] + cost
+            target_view = new_dp[tuple(dest)]
+            better = candidate < target_view
+            target_view[better] = candidate[better]
+            choice[tuple(dest)][better] = index
+        dp = new_dp
+        choices.append(choice)
+    
+    # 選出最佳的最終狀態
+    sums = np.indices(dims)
+    reachable = dp < inf
+    hits = sum((sums[j] == targets[j]).astype(np.int64) for j in range(len(dims)))
+    totals = sums.reshape(len(dims), -1).sum(axis=0).reshape(dims)
+    # 組合成單一排序鍵：達成數 > 總和 > 成本（越小越好）
+    max_cost = int(dp[reachable].max()) + 1
+    max_total = int(totals.max()) + 1
+    score = (hits * max_total + totals) * max_cost - np.where(reachable, dp, 0)
+    score = np.where(reachable, score, -1)
+    state = list(np.unravel_index(int(np.argmax(score)), dims))
+    
+    # 回溯每張卡牌的選擇
+    plans = [RequirementPlan(symbol, target, []) for symbol, target in requirements]
+    for card_index in range(len(cards) - 1, -1, -1):
+        option_index = int(choices[card_index][tuple(state)])
+        if option_index < 0:
+            continue
+        j, value, flip = options_per_card[card_index][option_index]
+        plans[j].plays.append(PlannedPlay(cards[card_index], flip, value))
+        state[j] -= value
+    
+    for plan in plans:
+        plan.plays.reverse()
+    return plans
+
+class PlanCache:
+    """出牌計畫快取 - 以手牌內容、階段與需求為鍵的有限大小 LRU
+
+    手牌簽章為每張卡牌 (目前的面, 另一面) 的多重集合，與卡牌順序、位置無關；
+    快取的計畫以排序後的卡牌索引保存，命中時對應回實際的卡牌物件。
+    指定 path 時啟動時載入、save() 時寫回磁碟（JSON）。
+    """
+    def __init__(self, maxsize: int = 4096, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.solve_seconds = 0.0  # 未命中時實際求解的總耗時
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @staticmethod
+    def _face(card: Card) -> Tuple[str, int, str, int]:
+        return (card.get_current_symbol().name, card.get_current_value(),
+                card.get_other_symbol().name, card.get_other_value())
+    
+    def signature(self, cards: List[Card], phase: Optional[GamePhase],
+                  requirements: List[Tuple[CardSymbol, int]]) -> Tuple[str, List[Card]]:
+        """回傳 (快取鍵, 依簽章排序的卡牌)"""
+        ordered = sorted(cards, key=self._face)
+        hand = ",".join("%s%d/%s%d" % self._face(card) for card in ordered)
+        wanted = ",".join(f"{symbol.name}{target}" for symbol, target in requirements)
+        return f"{phase.name if phase else '*'}|{wanted}|{hand}", ordered
+    
+    def get_or_solve(self, cards: List[Card], phase: Optional[GamePhase],
+                     requirements: List[Tuple[CardSymbol, int]],
+                     solve: Callable[[], List[RequirementPlan]]) -> List[RequirementPlan]:
+        """查詢快取，未命中時呼叫 solve() 求解並存入"""
+        key, ordered = self.signature(cards, phase, requirements)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            return [RequirementPlan(CardSymbol[symbol], target,
+                                    [PlannedPlay(ordered[index], flip, value) for index, flip, value in plays])
+                    for symbol, target, plays in entry]
+        
+        start = time.perf_counter()
+        plans = solve()
+        elapsed = time.perf_counter() - start
+        positions = {id(card): index for index, card in enumerate(ordered)}
+        entry = [[plan.symbol.name, plan.target,
+                  [[positions[id(play.card)], play.flip, play.value] for play in plan.plays]]
+                 for plan in plans]
+        with self._lock:
+            self.misses += 1
+            self.solve_seconds += elapsed
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        return plans
+    
+    def stats(self) -> Dict[str, float]:
+        """命中次數、命中率與估計省下的求解時間（以未命中的平均求解耗時估計）"""
+        with self._lock:
+            total = self.hits + self.misses
+            average = self.solve_seconds / self.misses if self.misses else 0.0
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_ms": self.hits * average * 1000,
+            }
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+    
+    def load(self, path: str):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"無法載入計畫快取 {path}: {e}")
+            return
+        with self._lock:
+            self._entries = OrderedDict(list(entries.items())[-self.maxsize:])
+            self._dirty = False
+    
+    def save(self, path: Optional[str] = None):
+        """寫回磁碟（沒有變更時不寫入）"""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            if not self._dirty and path == self.path:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, path)
+
+# 卡牌兩面的識別結果 (上符號, 上數值, 下符號, 下數值)
+CardFaces = Tuple[CardSymbol, int, CardSymbol, int]
+# 識別結果與信心（兩面符號與數值中最低的信心，沒有辨識出來的項目為 0）
+RecognizedFaces = Tuple[CardFaces, float]
+
+# 符號模板檔案（需要預先準備符號的模板圖片）
+SYMBOL_TEMPLATE_FILES = {
+    CardSymbol.MOVE: "move_template.png",
+    CardSymbol.SHIELD: "shield_template.png",
+    CardSymbol.SWORD: "sword_template.png",
+    CardSymbol.GUN: "gun_template.png",
+    CardSymbol.SPECIAL: "special_template.png"
+}
+
+# 預設的模板縮放比例，讓遊戲視窗縮放後仍能辨識符號
+DEFAULT_TEMPLATE_SCALES = (0.8, 1.0, 1.25)
+
+class TemplateBank:
+    """符號模板庫 - 一次載入並預處理所有模板，供所有識別呼叫共用
+
+    模板以灰階、連續記憶體儲存，可選擇預先產生多個縮放比例。
+    只有在模板檔案的修改時間改變時才會重新載入。
+    """
+    _shared: Dict[Tuple[str, Tuple[float, ...]], "TemplateBank"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, template_dir: str = ".",
+                 files: Optional[Dict[CardSymbol, str]] = None,
+                 scales: Tuple[float, ...] = (1.0,),
+                 check_interval: float = 1.0):
+        self.template_dir = template_dir
+        self.files = dict(files or SYMBOL_TEMPLATE_FILES)
+        self.scales = tuple(scales)
+        self.check_interval = check_interval  # 檢查檔案修改時間的最短間隔（秒）
+        self.reload_count = 0
+        self._lock = threading.Lock()
+        self._mtimes: Dict[CardSymbol, Optional[float]] = {}
+        self._templates: Dict[CardSymbol, List[np.ndarray]] = {}
+        self._last_check = 0.0
+        self.refresh(force=True)
+    
+    @classmethod
+    def shared(cls, template_dir: str = ".",
+               scales: Tuple[float, ...] = (1.0,)) -> "TemplateBank":
+        """取得共用的模板庫（相同資料夾與縮放設定只會載入一次）"""
+        key = (os.path.abspath(template_dir), tuple(scales))
+        with cls._shared_lock:
+            bank = cls._shared.get(key)
+            if bank is None:
+                bank = cls(template_dir, scales=scales)
+                cls._shared[key] = bank
+            return bank
+    
+    def refresh(self, force: bool = False) -> bool:
+        """檢查模板檔案是否有變更，有變更時重新載入；回傳是否重新載入"""
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return False
+        
+        changed = False
+        with self._lock:
+            self._last_check = now
+            for symbol, filename in self.files.items():
+                path = os.path.join(self.template_dir, filename)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    mtime = None
+                
+                if not force and symbol in self._mtimes and self._mtimes[symbol] == mtime:
+                    continue
+                
+                self._mtimes[symbol] = mtime
+                self._templates[symbol] = self._load_template(path) if mtime is not None else []
+                changed = True
+            
+            if changed:
+                self.reload_count += 1
+        return changed
+    
+    def _load_template(self, path: str) -> List[np.ndarray]:
+        """載入單一模板並產生各縮放比例的灰階版本"""
+        template = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if template is None:
+            print(f"無法讀取模板: {path}")
+            return []
+        
+        scaled = []
+        for scale in self.scales:
+            if scale == 1.0:
+                resized = template
+            else:
+                interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+                resized = cv2.resize(template, None, fx=scale, fy=scale, interpolation=interpolation)
+            if resized.shape[0] > 0 and resized.shape[1] > 0:
+                scaled.append(np.ascontiguousarray(resized))
+        return scaled
+    
+    def get(self, symbol: CardSymbol) -> List[np.ndarray]:
+        """取得指定符號的所有縮放模板"""
+        self.refresh()
+        return self._templates.get(symbol, [])
+    
+    def items(self) -> List[Tuple[CardSymbol, List[np.ndarray]]]:
+        """取得所有符號與其模板（依 files 的順序）"""
+        self.refresh()
+        with self._lock:
+            return [(symbol, self._templates.get(symbol, [])) for symbol in self.files]
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """轉換為灰階（已是灰階則直接回傳）"""
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def card_fingerprint(card_gray: np.ndarray) -> bytes:
+    """卡牌符號與數值區域的雜湊，畫面沒變時相同
+
+    只取上下兩面所在的中間一半，縮為半解析度並去掉低位元後雜湊；
+    數值字形只要有幾個像素不同就會得到不同的指紋。
+    """
+    height = card_gray.shape[0]
+    faces = card_gray[height // 4:height - height // 4]
+    small = cv2.resize(faces, (max(1, faces.shape[1] // 2), max(1, faces.shape[0] // 2)),
+                       interpolation=cv2.INTER_AREA)
+    digest = hashlib.blake2b(np.ascontiguousarray(small >> 4).tobytes(), digest_size=16)
+    digest.update(struct.pack("<2I", *card_gray.shape[:2]))
+    return digest.digest()
+
+class RecognitionCache:
+    """卡牌指紋 → 識別結果的有限大小 LRU 快取
+
+    值為 None 表示該位置沒有卡牌。只應存入信心足夠的識別結果。
+    """
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Optional[RecognizedFaces]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def lookup(self, fingerprint: bytes) -> Tuple[bool, Optional[RecognizedFaces]]:
+        """查詢快取，回傳 (是否命中, 識別結果)"""
+        with self._lock:
+            if fingerprint in self._entries:
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return True, self._entries[fingerprint]
+            self.misses += 1
+            return False, None
+    
+    def put(self, fingerprint: bytes, faces: Optional[RecognizedFaces]):
+        with self._lock:
+            self._entries[fingerprint] = faces
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class SymbolMatcher:
+    """批次符號匹配器 - 一次比對所有區域與所有模板
+
+    相同尺寸的區域會垂直拼接成一張圖，每個模板只需呼叫一次
+    cv2.matchTemplate，再依區域切開結果取最大值。
+    TM_CCOEFF_NORMED 只與視窗內像素有關，因此跨越區域邊界的
+    視窗直接捨棄即可，結果與逐一比對相同。
+    """
+    def __init__(self, template_bank: TemplateBank):
+        self.template_bank = template_bank
+    
+    @property
+    def symbols(self) -> List[CardSymbol]:
+        return list(self.template_bank.files)
+    
+    def score_regions(self, gray_regions: List[np.ndarray]) -> np.ndarray:
+        """計算 (區域數 × 符號數) 的匹配分數矩陣"""
+        bank_items = self.template_bank.items()
+        scores = np.zeros((len(gray_regions), len(bank_items)), dtype=np.float32)
+        if not gray_regions:
+            return scores
+        
+        columns = [column for column, (_, templates) in enumerate(bank_items) for _ in templates]
+        templates = [template for _, symbol_templates in bank_items for template in symbol_templates]
+        candidate_scores, _ = self._match_batch(gray_regions, templates)
+        for candidate, column in enumerate(columns):
+            scores[:, column] = np.maximum(scores[:, column], candidate_scores[:, candidate])
+        return scores
+    
+    def _match_batch(self, gray_regions: List[np.ndarray],
+                     templates: List[Optional[np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        """以拼接方式比對所有區域與模板
+
+        回傳 (區域數 × 模板數) 的最高分數（模板比區域大或為 None 時為 -1），
+        以及每個最高分數在區域內的左上角座標 (x, y)。
+        """
+        scores = np.full((len(gray_regions), len(templates)), -1.0, dtype=np.float32)
+        locations = np.zeros((len(gray_regions), len(templates), 2), dtype=np.int32)
+        
+        # 依尺寸分組，同尺寸的區域拼成一張圖
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for index, region in enumerate(gray_regions):
+            groups.setdefault(region.shape[:2], []).append(index)
+        
+        for (height, width), indices in groups.items():
+            if height == 0 or width == 0:
+                continue
+            mosaic = np.ascontiguousarray(np.vstack([gray_regions[i] for i in indices]))
+            count = len(indices)
+            
+            for column, template in enumerate(templates):
+                if template is None:
+                    continue
+                t_height, t_width = template.shape[:2]
+                if t_height > height or t_width > width:
+                    continue
+                result = cv2.matchTemplate(mosaic, template, cv2.TM_CCOEFF_NORMED)
+                
+                # 補齊到每個區域 height 列，再捨棄跨越邊界的視窗
+                padded = np.full((count * height, result.shape[1]), -1.0, dtype=np.float32)
+                padded[:result.shape[0]] = np.nan_to_num(result, nan=-1.0)
+                per_region = padded.reshape(count, height, -1)[:, :height - t_height + 1, :]
+                flat = per_region.reshape(count, -1)
+                best = flat.argmax(axis=1)
+                scores[indices, column] = flat[np.arange(count), best]
+                locations[indices, column, 0] = best % per_region.shape[2]
+                locations[indices, column, 1] = best // per_region.shape[2]
+        
+        return scores, locations
+    
+    def classify(self, scores: np.ndarray) -> List[Tuple[CardSymbol, float]]:
+        """從分數矩陣取出每個區域的最佳符號（沒有正分數時預設為移動）"""
+        symbols = self.symbols
+        results = []
+        if scores.shape[1] == 0:
+            return [(CardSymbol.MOVE, 0.0) for _ in range(scores.shape[0])]
+        best_columns = np.argmax(scores, axis=1)
+        for row, column in enumerate(best_columns):
+            score = float(scores[row, column])
+            results.append((symbols[column], score) if score > 0 else (CardSymbol.MOVE, score))
+        return results
+
+class PyramidSymbolMatcher(SymbolMatcher):
+    """由粗到細的符號匹配器
+
+    先在縮小的金字塔層比對所有模板（含所有縮放比例），只把分數最高的
+    候選帶回原始解析度，在粗略位置附近的小視窗內精確比對。
+    某個符號分數夠高且明顯領先其他符號時，就不再精確比對剩下的候選，
+    因此增加模板縮放比例時主要只增加低解析度的成本。
+    模板縮小後太小時，該模板直接以原始解析度比對。
+    """
+    def __init__(self, template_bank: TemplateBank,
+                 pyramid_levels: int = 1,
+                 top_k: int = 2,
+                 confident_score: float = 0.8,
+                 confident_margin: float = 0.15,
+                 refine_radius: int = 2,
+                 min_coarse_size: int = 6):
+        super().__init__(template_bank)
+        self.pyramid_levels = pyramid_levels
+        self.top_k = top_k  # 至少精確比對幾個候選
+        self.confident_score = confident_score  # 達到此分數且領先 confident_margin 時提前結束
+        self.confident_margin = confident_margin
+        self.refine_radius = refine_radius  # 精確比對時在粗略位置周圍額外搜尋的像素
+        self.min_coarse_size = min_coarse_size
+        self._coarse_cache: Tuple[int, List[np.ndarray], List[Optional[np.ndarray]]] = (-1, [], [])
+        self._cache_lock = threading.Lock()
+    
+    def _downsample(self, image: np.ndarray) -> np.ndarray:
+        for _ in range(self.pyramid_levels):
+            image = cv2.pyrDown(image)
+        return image
+    
+    def _coarse_templates(self, templates: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+        """縮小後的模板（模板庫重新載入時才重新產生）"""
+        with self._cache_lock:
+            reload_count, cached_sources, cached = self._coarse_cache
+            if (reload_count == self.template_bank.reload_count and len(cached_sources) == len(templates)
+                    and all(a is b for a, b in zip(cached_sources, templates))):
+                return cached
+            coarse = []
+            for template in templates:
+                small = self._downsample(template)
+                coarse.append(np.ascontiguousarray(small) if min(small.shape[:2]) >= self.min_coarse_size else None)
+            self._coarse_cache = (self.template_bank.reload_count, list(templates), coarse)
+            return coarse
+    
+    def _refine(self, region: np.ndarray, template: np.ndarray, location: np.ndarray) -> float:
+        """在粗略位置附近以原始解析度比對，回傳最高分數"""
+        factor = 1 << self.pyramid_levels
+        radius = self.refine_radius + factor
+        t_height, t_width = template.shape[:2]
+        x = int(location[0]) * factor
+        y = int(location[1]) * factor
+        left = max(0, x - radius)
+        top = max(0, y - radius)
+        right = min(region.shape[1], x + radius + t_width)
+        bottom = min(region.shape[0], y + radius + t_height)
+        if right - left < t_width or bottom - top < t_height:
+            return -1.0
+        window = region[top:bottom, left:right]
+        result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        return float(cv2.minMaxLoc(result)[1])
+    
+    def score_regions(self, gray_regions: List[np.ndarray]) -> np.ndarray:
+        """計算 (區域數 × 符號數) 的匹配分數矩陣
+
+        精確比對過的符號為原始解析度的分數，其餘符號為低解析度的估計分數
+        （一定低於最佳符號）。
+        """
+        bank_items = self.template_bank.items()
+        scores = np.zeros((len(gray_regions), len(bank_items)), dtype=np.float32)
+        if not gray_regions:
+            return scores
+        
+        columns = [column for column, (_, templates) in enumerate(bank_items) for _ in templates]
+        templates = [template for _, symbol_templates in bank_items for template in symbol_templates]
+        if not templates:
+            return scores
+        
+        column_index = np.array(columns)
+        
+        # 低解析度比對所有候選；太小無法縮小的模板直接在原始解析度比對
+        coarse_templates = self._coarse_templates(templates)
+        coarse_scores, coarse_locations = self._match_batch(
+            [self._downsample(region) for region in gray_regions], coarse_templates)
+        exact = [candidate for candidate, template in enumerate(coarse_templates) if template is None]
+        if exact:
+            exact_scores, _ = self._match_batch(gray_regions, [templates[c] for c in exact])
+        
+        for row, region in enumerate(gray_regions):
+            estimates = coarse_scores[row].copy()
+            refined = np.full(len(templates), np.nan, dtype=np.float32)
+            for i, candidate in enumerate(exact):
+                refined[candidate] = exact_scores[row, i]
+                estimates[candidate] = -1.0
+            
+            order = [candidate for candidate in np.argsort(-estimates) if estimates[candidate] > -1.0]
+            best_candidate = int(np.nanargmax(refined)) if exact and not np.all(np.isnan(refined)) else -1
+            best = float(refined[best_candidate]) if best_candidate >= 0 else -1.0
+            
+            for rank, candidate in enumerate(order):
+                if rank >= self.top_k and estimates[candidate] <= best:
+                    break
+                refined[candidate] = self._refine(region, templates[candidate], coarse_locations[row, candidate])
+                if refined[candidate] > best:
+                    best_candidate, best = int(candidate), float(refined[candidate])
+                
+                if best >= self.confident_score:
+                    # 與其他符號的最高分數（精確或估計）比較
+                    combined = np.where(np.isnan(refined), estimates, refined)
+                    others = combined[column_index != column_index[best_candidate]]
+                    if best - others.max(initial=-1.0) >= self.confident_margin:
+                        break
+            
+            np.maximum.at(scores[row], column_index, np.where(np.isnan(refined), estimates, refined))
+        
+        return scores
+
+@dataclass
+class DigitReading:
+    """數值識別結果"""
+    value: int
+    confidence: float
+    source: str = "template"  # "template"、"tesseract" 或 "default"
+
+class DigitRecognizer:
+    """程序內數字識別引擎 - 正規化字形後以最近鄰比對數字原型
+
+    數字原型優先從 template_dir 載入（0.png ~ 9.png，或 3_xxx.png 形式的
+    多個樣本），沒有時以 OpenCV 字型自動產生。同一畫面的所有數值區域
+    會一次以矩陣乘法完成比對；信心不足時才改用 tesseract（可選）。
+    """
+    GLYPH_SIZE = (12, 16)  # (寬, 高)
+    _shared: Dict[str, "DigitRecognizer"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, template_dir: str = "digit_templates",
+                 min_confidence: float = 0.7,
+                 glyph_threshold: float = 0.6,
+                 use_tesseract: bool = True):
+        self.template_dir = template_dir
+        self.min_confidence = min_confidence  # 低於此信心時改用 tesseract
+        self.glyph_threshold = glyph_threshold  # 低於此分數的連通區域不視為數字
+        self.use_tesseract = use_tesseract
+        self._tesseract_failed = False
+        self.prototypes, self.labels = self._build_prototypes()
+    
+    @classmethod
+    def shared(cls, template_dir: str = "digit_templates") -> "DigitRecognizer":
+        """取得共用的數字識別器"""
+        key = os.path.abspath(template_dir)
+        with cls._shared_lock:
+            recognizer = cls._shared.get(key)
+            if recognizer is None:
+                recognizer = cls(template_dir)
+                cls._shared[key] = recognizer
+            return recognizer
+    
+    def _normalize_glyph(self, glyph: np.ndarray) -> np.ndarray:
+        """將字形縮放到固定大小並正規化為零均值、單位長度的向量"""
+        resized = cv2.resize(glyph, self.GLYPH_SIZE, interpolation=cv2.INTER_AREA)
+        vector = resized.astype(np.float32).ravel()
+        vector -= vector.mean()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def _build_prototypes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """載入或產生數字原型矩陣 (原型數 × 向量長度)"""
+        vectors = []
+        labels = []
+        
+        if os.path.isdir(self.template_dir):
+            for filename in sorted(os.listdir(self.template_dir)):
+                name, ext = os.path.splitext(filename)
+                digit = name.split('_')[0]
+                if ext.lower() != '.png' or not digit.isdigit() or len(digit) != 1:
+                    continue
+                image = cv2.imread(os.path.join(self.template_dir, filename), cv2.IMREAD_GRAYSCALE)
+                if image is None:
+                    continue
+                for glyph, _ in self._segment(image):
+                    vectors.append(self._normalize_glyph(glyph))
+                    labels.append(int(digit))
+                    break
+        
+        if not vectors:
+            # 沒有數字模板時以內建字型產生原型
+            fonts = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX,
+                     cv2.FONT_HERSHEY_PLAIN, cv2.FONT_HERSHEY_TRIPLEX]
+            for digit in range(10):
+                for font in fonts:
+                    for thickness in (1, 2, 3):
+                        canvas = np.zeros((64, 64), dtype=np.uint8)
+                        cv2.putText(canvas, str(digit), (12, 52), font, 1.8, 255, thickness)
+                        for glyph, _ in self._segment(canvas):
+                            vectors.append(self._normalize_glyph(glyph))
+                            labels.append(digit)
+                            break
+        
+        return np.array(vectors, dtype=np.float32), np.array(labels, dtype=np.int32)
+    
+    def _segment(self, gray: np.ndarray) -> List[Tuple[np.ndarray, int]]:
+        """切出可能是數字的連通區域，回傳 (字形二值圖, 左側 x) 並依 x 排序"""
+        if gray.size == 0:
+            return []
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # 前景應為少數像素，否則反轉
+        if np.count_nonzero(binary) > binary.size // 2:
+            binary = cv2.bitwise_not(binary)
+        
+        count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        height = gray.shape[0]
+        glyphs = []
+        for label in range(1, count):
+            x, y, w, h, area = stats[label]
+            if area < 8 or h < height * 0.3 or h == height or w > h * 1.2:
+                continue
+            glyphs.append((binary[y:y+h, x:x+w], int(x)))
+        glyphs.sort(key=lambda item: item[1])
+        return glyphs
+    
+    def recognize_batch(self, gray_regions: List[np.ndarray]) -> List[DigitReading]:
+        """一次識別多個數值區域"""
+        glyph_vectors = []
+        owners = []  # 每個字形屬於哪個區域與其位置 (區域索引, 左側 x, 右側 x, 高度)
+        for index, region in enumerate(gray_regions):
+            for glyph, left in self._segment(to_gray(region)):
+                glyph_vectors.append(self._normalize_glyph(glyph))
+                owners.append((index, left, left + glyph.shape[1], glyph.shape[0]))
+        
+        # 每個區域的候選數字 (數字, 分數, 左側 x, 右側 x, 高度)
+        digits: List[List[Tuple[int, float, int, int, int]]] = [[] for _ in gray_regions]
+        if glyph_vectors and len(self.prototypes):
+            # 所有字形與所有原型的相似度一次算完
+            similarity = np.stack(glyph_vectors) @ self.prototypes.T
+            best = np.argmax(similarity, axis=1)
+            for row, (owner, left, right, height) in enumerate(owners):
+                score = float(similarity[row, best[row]])
+                if score >= self.glyph_threshold:
+                    digits[owner].append((int(self.labels[best[row]]), score, left, right, height))
+        
+        readings = []
+        for index, region_digits in enumerate(digits):
+            if region_digits:
+                # 相鄰的字形才屬於同一個數值，避免把符號誤認為數字
+                group = self._best_group(region_digits)
+                value = int(''.join(str(digit) for digit, *_ in group))
+                reading = DigitReading(value, min(score for _, score, *_ in group))
+            else:
+                reading = DigitReading(1, 0.0, "default")
+            
+            if reading.confidence < self.min_confidence:
+                fallback = self._read_with_tesseract(to_gray(gray_regions[index]))
+                if fallback is not None:
+                    reading = fallback
+            readings.append(reading)
+        return readings
+    
+    @staticmethod
+    def _best_group(candidates: List[Tuple[int, float, int, int, int]]) -> List[Tuple[int, float, int, int, int]]:
+        """將候選數字依間距分組，回傳分數最高的一組"""
+        groups = [[candidates[0]]]
+        for candidate in candidates[1:]:
+            previous = groups[-1][-1]
+            gap = candidate[2] - previous[3]
+            if gap <= max(candidate[4], previous[4]) * 0.6:
+                groups[-1].append(candidate)
+            else:
+                groups.append([candidate])
+        return max(groups, key=lambda group: (min(c[1] for c in group), len(group)))
+    
+    def recognize(self, gray_region: np.ndarray) -> DigitReading:
+        """識別單一數值區域"""
+        return self.recognize_batch([gray_region])[0]
+    
+    def _read_with_tesseract(self, gray: np.ndarray) -> Optional[DigitReading]:
+        """信心不足時以 tesseract 辨識（未安裝或失敗時回傳 None）"""
+        if not self.use_tesseract or self._tesseract_failed:
+            return None
+        try:
+            text = pytesseract.image_to_string(gray, config='--psm 8 -c tessedit_char_whitelist=0123456789')
+        except Exception as e:
+            # 只提示一次，之後不再嘗試啟動 tesseract
+            print(f"tesseract 無法使用，僅使用內建數字識別: {e}")
+            self._tesseract_failed = True
+            return None
+        text = text.strip()
+        if text.isdigit():
+            return DigitReading(int(text), self.min_confidence, "tesseract")
+        return None
+
+def union_rect(rects: List[Rect]) -> Rect:
+    """計算多個矩形的外接矩形"""
+    left = min(r[0] for r in rects)
+    top = min(r[1] for r in rects)
+    right = max(r[0] + r[2] for r in rects)
+    bottom = max(r[1] + r[3] for r in rects)
+    return (left, top, right - left, bottom - top)
+
+def require_pyautogui():
+    """取得 pyautogui（第一次呼叫時才載入），無法使用時拋出錯誤"""
+    global pyautogui, _pyautogui_error
+    if pyautogui is None and _pyautogui_error is None:
+        try:
+            import pyautogui as module
+        except Exception as e:
+            _pyautogui_error = str(e)
+        else:
+            # 設定安全機制（點擊後的等待由 ActionExecutor 確認畫面變化取代）
+            module.FAILSAFE = True
+            module.PAUSE = 0.0
+            pyautogui = module
+    if pyautogui is None:
+        raise RuntimeError(f"無法載入 pyautogui（沒有顯示環境？）: {_pyautogui_error}")
+    return pyautogui
+
+class Frame:
+    """一次擷取的畫面 - 可能是整個螢幕，也可能只有數個感興趣區域(ROI)
+
+    所有座標都以螢幕座標表示，crop() 會回傳對應區域的檢視（不複製資料）。
+    """
+    def __init__(self, regions: List[Tuple[Rect, np.ndarray]],
+                 index: int = 0, timestamp: Optional[float] = None,
+                 is_full: bool = False):
+        self.regions = regions
+        self.index = index
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.is_full = is_full  # regions 只有一個區域且為整張畫面
+    
+    @classmethod
+    def full(cls, image: np.ndarray, index: int = 0) -> "Frame":
+        """以整張畫面建立 Frame"""
+        height, width = image.shape[:2]
+        return cls([((0, 0, width, height), image)], index, is_full=True)
+    
+    @property
+    def image(self) -> np.ndarray:
+        """整張畫面（只有擷取整個螢幕時才有）"""
+        if not self.is_full:
+            raise ValueError("此畫面只包含部分區域")
+        return self.regions[0][1]
+    
+    def crop(self, rect: Rect) -> np.ndarray:
+        """取出指定螢幕區域"""
+        x, y, w, h = rect
+        for (rx, ry, rw, rh), array in self.regions:
+            if rx <= x and ry <= y and x + w <= rx + rw and y + h <= ry + rh:
+                return array[y-ry:y-ry+h, x-rx:x-rx+w]
+        raise ValueError(f"畫面中沒有區域 {rect}")
+
+class FrameSource:
+    """畫面來源基底類別"""
+    def size(self) -> Tuple[int, int]:
+        """畫面尺寸 (寬, 高)"""
+        raise NotImplementedError
+    
+    def grab(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        """擷取一張畫面；rois 為 None 時擷取整個畫面，來源結束時回傳 None"""
+        raise NotImplementedError
+    
+    def snapshot(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        """取得目前的畫面供確認動作結果使用
+
+        即時來源直接重新擷取；回放來源則回傳目前的畫面而不前進，
+        避免輪詢消耗掉後續回合的畫面。
+        """
+        return self.grab(rois)
+    
+    def close(self):
+        pass
+
+class ScreenFrameSource(FrameSource):
+    """從螢幕擷取畫面（pyautogui）
+
+    每個區域使用預先配置的緩衝區輪流存放，避免每次都配置新陣列。
+    同一區域的畫面在 buffer_count 次擷取後會被覆寫，需要保留時請自行複製。
+    緩衝區以區域為鍵，最多保留 max_regions 個最近使用的區域
+    （確認動作時擷取的卡牌區域會隨位置改變，不能無限累積）。
+    指定 window 時只擷取該視窗範圍，畫面座標以視窗左上角為原點。
+    """
+    def __init__(self, buffer_count: int = 2, window: Optional[Rect] = None,
+                 max_regions: int = 64):
+        self.buffer_count = buffer_count
+        self.window = window
+        self.max_regions = max_regions
+        self._buffers: "OrderedDict[Rect, List[np.ndarray]]" = OrderedDict()
+        self._next_buffer: Dict[Rect, int] = {}
+        self._index = 0
+        self._lock = threading.Lock()
+    
+    def size(self) -> Tuple[int, int]:
+        if self.window is not None:
+            return (self.window[2], self.window[3])
+        return tuple(require_pyautogui().size())
+    
+    def _buffer_for(self, rect: Rect) -> np.ndarray:
+        buffers = self._buffers.get(rect)
+        if buffers is None:
+            buffers = [np.empty((rect[3], rect[2], 3), dtype=np.uint8) for _ in range(self.buffer_count)]
+            self._buffers[rect] = buffers
+            self._next_buffer[rect] = 0
+            while len(self._buffers) > self.max_regions:
+                evicted, _ = self._buffers.popitem(last=False)
+                del self._next_buffer[evicted]
+        else:
+            self._buffers.move_to_end(rect)
+        slot = self._next_buffer[rect]
+        self._next_buffer[rect] = (slot + 1) % self.buffer_count
+        return buffers[slot]
+    
+    def _grab_region(self, rect: Optional[Rect]) -> Tuple[Rect, np.ndarray]:
+        gui = require_pyautogui()
+        if self.window is not None:
+            if rect is None:
+                rect = (0, 0, self.window[2], self.window[3])
+            screen_rect = (rect[0] + self.window[0], rect[1] + self.window[1], rect[2], rect[3])
+            screenshot = gui.screenshot(region=screen_rect)
+        else:
+            screenshot = gui.screenshot(region=rect) if rect else gui.screenshot()
+        rgb = np.asarray(screenshot)
+        if rect is None:
+            rect = (0, 0, rgb.shape[1], rgb.shape[0])
+        buffer = self._buffer_for(rect)
+        if buffer.shape[:2] != rgb.shape[:2]:
+            # 螢幕邊緣的區域可能被裁切，改用實際尺寸
+            buffer = np.empty(rgb.shape, dtype=np.uint8)
+        cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=buffer)
+        return rect, buffer
+    
+    def grab(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        with self._lock:
+            if rois:
+                regions = [self._grab_region(rect) for rect in rois]
+            else:
+                regions = [self._grab_region(None)]
+            self._index += 1
+            return Frame(regions, self._index, is_full=not rois)
+
+class ReplayFrameSource(FrameSource):
+    """回放畫面來源 - 從 PNG 序列、影片檔或記憶體中的畫面讀取
+
+    可在沒有顯示環境的機器上執行與效能測試。ROI 直接取自整張畫面的檢視。
+    """
+    def __init__(self, source: Union[str, List[np.ndarray]], loop: bool = False):
+        self.loop = loop
+        self._images: Optional[List[np.ndarray]] = None
+        self._paths: List[str] = []
+        self._capture = None
+        self._buffer: Optional[np.ndarray] = None
+        self._position = 0
+        self._index = 0
+        self._size: Optional[Tuple[int, int]] = None
+        self._current: Optional[Frame] = None  # 最近一次 grab 的整張畫面
+        self._peeked = False  # snapshot 在第一次 grab 前先讀取了畫面，下次 grab 直接使用
+        self._lock = threading.Lock()
+        
+        if isinstance(source, list):
+            self._images = source
+        elif os.path.isdir(source):
+            self._paths = sorted(glob.glob(os.path.join(source, '*.png')))
+            if not self._paths:
+                raise ValueError(f"資料夾中沒有 PNG 畫面: {source}")
+        elif source.lower().endswith('.png'):
+            self._paths = [source]
+        else:
+            self.video_path = source
+            self._capture = cv2.VideoCapture(source)
+            if not self._capture.isOpened():
+                raise ValueError(f"無法開啟影片: {source}")
+    
+    def __len__(self) -> int:
+        if self._images is not None:
+            return len(self._images)
+        if self._paths:
+            return len(self._paths)
+        return int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    
+    def size(self) -> Tuple[int, int]:
+        if self._size is None:
+            if self._capture is not None:
+                self._size = (int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                              int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            else:
+                image = self._read_image(0)
+                self._size = (image.shape[1], image.shape[0])
+        return self._size
+    
+    def _read_image(self, position: int) -> np.ndarray:
+        if self._images is not None:
+            return self._images[position]
+        image = cv2.imread(self._paths[position], cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"無法讀取畫面: {self._paths[position]}")
+        return image
+    
+    def _next_image(self) -> Optional[np.ndarray]:
+        if self._capture is not None:
+            ok, image = self._capture.read(self._buffer)
+            if not ok and self.loop:
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self._capture.read(self._buffer)
+            if not ok:
+                return None
+            self._buffer = image  # 之後的讀取重複使用同一緩衝區
+            return image
+        
+        if self._position >= len(self):
+            if not self.loop or len(self) == 0:
+                return None
+            self._position = 0
+        image = self._read_image(self._position)
+        self._position += 1
+        return image
+    
+    def grab(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        with self._lock:
+            if self._peeked:
+                self._peeked = False
+                frame = self._current
+            else:
+                image = self._next_image()
+                if image is None:
+                    return None
+                self._index += 1
+                frame = self._current = Frame.full(image, self._index)
+        return self._select(frame, rois)
+    
+    def snapshot(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        with self._lock:
+            if self._current is None:
+                image = self._next_image()
+                if image is None:
+                    return None
+                self._index += 1
+                self._current = Frame.full(image, self._index)
+                self._peeked = True
+            frame = self._current
+        return self._select(frame, rois)
+    
+    def _select(self, frame: Frame, rois: Optional[List[Rect]]) -> Frame:
+        if rois:
+            return Frame([(rect, frame.crop(rect)) for rect in rois], frame.index, frame.timestamp)
+        return frame
+    
+    def close(self):
+        if self._capture is not None:
+            self._capture.release()
+
+class CardLocator:
+    """手牌定位與追蹤 - 不依賴固定的卡牌間距與數量
+
+    定位：在縮小的手牌區域上找出外輪廓，依尺寸與長寬比篩選出卡牌矩形。
+    追蹤：之後每次只檢查已知位置的卡牌邊框是否仍在，以及卡牌以外的
+    背景縮圖是否改變（有新卡牌加入）；任一檢查失敗，或每隔
+    relocalize_interval 次才重新定位。
+    """
+    BACKGROUND_SCALE = 0.125  # 背景檢查用縮圖的比例
+    BORDER_OFFSET = 4  # 邊框檢查時取邊框內外各幾個像素比較
+    BORDER_CONTRAST = 25  # 邊框內外的灰階差超過此值視為有邊框
+    BORDER_STEP = 2  # 邊框取樣間距
+
+    def __init__(self, downscale: float = 0.5,
+                 min_card_height: int = 40,
+                 aspect_range: Tuple[float, float] = (1.2, 2.0),
+                 border_threshold: float = 0.5,
+                 background_threshold: float = 12.0,
+                 relocalize_interval: int = 300):
+        self.downscale = downscale
+        self.min_card_height = min_card_height  # 最小卡牌高度（原始像素）
+        self.aspect_range = aspect_range  # 卡牌 高/寬 的範圍
+        self.border_threshold = border_threshold  # 邊框上有邊緣的比例低於此值視為卡牌已不在
+        self.background_threshold = background_threshold  # 卡牌以外區域的平均灰階差超過此值時重新定位
+        self.relocalize_interval = relocalize_interval
+        self.rects: List[Rect] = []  # 目前追蹤的卡牌（螢幕座標）
+        self.relocalize_count = 0
+        self._frames_since_locate = 0
+        self._origin: Optional[Tuple[int, int]] = None
+        self._background: Optional[np.ndarray] = None
+        self._background_mask: Optional[np.ndarray] = None
+        self._border_index: Optional[Tuple[np.ndarray, ...]] = None
+    
+    def reset(self):
+        self.rects = []
+        self._origin = None
+        self._border_index = None
+    
+    def locate(self, hand_gray: np.ndarray, origin: Tuple[int, int]) -> List[Rect]:
+        """在手牌區域中完整定位所有卡牌，origin 為手牌區域左上角的螢幕座標"""
+        scale = self.downscale
+        small = cv2.resize(hand_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (3, 3), 0)  # 抑制雜訊，避免雜訊邊緣把相鄰卡牌連在一起
+        edges = cv2.Canny(small, 50, 150)
+        edges = cv2.dilate(edges, np.ones((3, 3), dtype=np.uint8))
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        rects = []
+        min_aspect, max_aspect = self.aspect_range
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            if h < self.min_card_height * scale or w == 0:
+                continue
+            if not min_aspect <= h / w <= max_aspect:
+                continue
+            # 換回原始解析度（膨脹使外框多出約 1 像素）
+            rects.append((int(round((x + 1) / scale)) + origin[0], int(round((y + 1) / scale)) + origin[1],
+                          int(round((w - 2) / scale)), int(round((h - 2) / scale))))
+        
+        rects.sort(key=lambda rect: rect[0])
+        self.rects = rects
+        self.relocalize_count += 1
+        self._frames_since_locate = 0
+        self._origin = origin
+        self._border_index = self._border_samples(origin, rects, hand_gray.shape[:2]) if rects else None
+        
+        # 記錄卡牌以外區域的縮圖，用來偵測新加入的卡牌
+        self._background = self._thumbnail(hand_gray)
+        mask = np.ones(self._background.shape, dtype=np.uint8)
+        for rect in rects:
+            x0 = int((rect[0] - origin[0]) * self.BACKGROUND_SCALE) - 1
+            y0 = int((rect[1] - origin[1]) * self.BACKGROUND_SCALE) - 1
+            x1 = int((rect[0] - origin[0] + rect[2]) * self.BACKGROUND_SCALE) + 2
+            y1 = int((rect[1] - origin[1] + rect[3]) * self.BACKGROUND_SCALE) + 2
+            mask[max(0, y0):y1, max(0, x0):x1] = 0
+        self._background_mask = mask.astype(bool)
+        return rects
+    
+    def _thumbnail(self, hand_gray: np.ndarray) -> np.ndarray:
+        scale = self.BACKGROUND_SCALE
+        return cv2.resize(hand_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR).astype(np.float32)
+    
+    def background_changed(self, hand_gray: np.ndarray) -> bool:
+        """卡牌以外的區域是否明顯改變（例如有新卡牌加入）"""
+        if self._background is None or not self._background_mask.any():
+            return False
+        thumbnail = self._thumbnail(hand_gray)
+        if thumbnail.shape != self._background.shape:
+            return True
+        diff = np.abs(thumbnail - self._background)[self._background_mask]
+        return float(diff.mean()) > self.background_threshold
+    
+    def _border_samples(self, origin: Tuple[int, int], rects: List[Rect],
+                        shape: Tuple[int, int]) -> Tuple[np.ndarray, ...]:
+        """計算每個矩形邊框外側與內側的取樣點索引（定位後只需計算一次）"""
+        height, width = shape
+        d = self.BORDER_OFFSET
+        step = self.BORDER_STEP
+        outer_y, outer_x, inner_y, inner_x, counts = [], [], [], [], []
+        for rect in rects:
+            x, y, w, h = rect[0] - origin[0], rect[1] - origin[1], rect[2], rect[3]
+            xs = np.arange(x, x + w, step)
+            ys = np.arange(y, y + h, step)
+            # 上、下、左、右四條邊：外側與內側的取樣點
+            for edge_y, sign in ((y, -1), (y + h - 1, 1)):
+                outer_y.append(np.full(len(xs), edge_y + sign * d))
+                inner_y.append(np.full(len(xs), edge_y - sign * d))
+                outer_x.append(xs)
+                inner_x.append(xs)
+            for edge_x, sign in ((x, -1), (x + w - 1, 1)):
+                outer_x.append(np.full(len(ys), edge_x + sign * d))
+                inner_x.append(np.full(len(ys), edge_x - sign * d))
+                outer_y.append(ys)
+                inner_y.append(ys)
+            counts.append(2 * len(xs) + 2 * len(ys))
+        
+        def clip(values: List[np.ndarray], limit: int) -> np.ndarray:
+            return np.clip(np.concatenate(values), 0, limit - 1)
+        
+        counts = np.maximum(np.array(counts), 1)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        return (clip(outer_y, height), clip(outer_x, width),
+                clip(inner_y, height), clip(inner_x, width), starts, counts)
+    
+    def border_scores(self, hand_gray: np.ndarray, origin: Tuple[int, int],
+                      rects: List[Rect]) -> np.ndarray:
+        """每個卡牌矩形邊框內外有明顯亮度差的比例（只讀取邊框附近的取樣點）"""
+        if not rects:
+            return np.zeros(0)
+        if rects is self.rects and self._border_index is not None:
+            samples = self._border_index
+        else:
+            samples = self._border_samples(origin, rects, hand_gray.shape[:2])
+        outer_y, outer_x, inner_y, inner_x, starts, counts = samples
+        outer = hand_gray[outer_y, outer_x].astype(np.int16)
+        inner = hand_gray[inner_y, inner_x].astype(np.int16)
+        strong = np.abs(outer - inner) > self.BORDER_CONTRAST
+        return np.add.reduceat(strong, starts) / counts
+    
+    def track(self, hand_gray: np.ndarray, origin: Tuple[int, int]) -> List[Rect]:
+        """追蹤卡牌位置，必要時重新定位"""
+        self._frames_since_locate += 1
+        if (origin != self._origin or self._frames_since_locate >= self.relocalize_interval
+                or self.background_changed(hand_gray)):
+            return self.locate(hand_gray, origin)
+        
+        if self.rects and (self.border_scores(hand_gray, origin, self.rects) < self.border_threshold).any():
+            return self.locate(hand_gray, origin)
+        return self.rects
+
+class StageMetrics:
+    """各階段的次數與耗時統計（p50/p95/p99），可定期輸出摘要或匯出 JSON/CSV
+
+    每個階段保留最近 max_samples 筆耗時計算百分位數，次數與總耗時則累計全部。
+    """
+    def __init__(self, max_samples: int = 10000, summary_interval: float = 60.0):
+        self.max_samples = max_samples
+        self.summary_interval = summary_interval  # 定期摘要的間隔（秒），0 表示不輸出
+        self._samples: Dict[str, "deque[float]"] = {}
+        self._counts: Dict[str, int] = {}
+        self._totals: Dict[str, float] = {}
+        self._current: Dict[str, float] = {}  # take_current() 之後各階段累計的耗時
+        self._lock = threading.Lock()
+        self._last_summary = time.monotonic()
+    
+    @contextmanager
+    def time(self, stage: str):
+        """量測 with 區塊的耗時"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+    
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = deque(maxlen=self.max_samples)
+                self._samples[stage] = samples
+                self._counts[stage] = 0
+                self._totals[stage] = 0.0
+            samples.append(seconds)
+            self._counts[stage] += 1
+            self._totals[stage] += seconds
+            self._current[stage] = self._current.get(stage, 0.0) + seconds
+    
+    def take_current(self) -> Dict[str, float]:
+        """取出上次呼叫之後各階段累計的耗時（秒）並重新開始累計"""
+        with self._lock:
+            current, self._current = self._current, {}
+        return current
+    
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+            self._current.clear()
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """每個階段的統計（毫秒）"""
+        with self._lock:
+            snapshot = {stage: (list(samples), self._counts[stage], self._totals[stage])
+                        for stage, samples in self._samples.items()}
+        result = {}
+        for stage, (samples, count, total) in snapshot.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+            result[stage] = {
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_ms": total / count * 1000,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": max(samples) * 1000,
+            }
+        return result
+    
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"{'階段':<14} {'次數':>8} {'平均':>9} {'p50':>9} {'p95':>9} {'p99':>9} (ms)")
+        for stage, stats in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+            print(f"{stage:<14} {stats['count']:>8} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>9.3f} "
+                  f"{stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f}")
+    
+    def maybe_print_summary(self):
+        """距離上次摘要超過 summary_interval 時輸出摘要"""
+        if self.summary_interval <= 0:
+            return
+        now = time.monotonic()
+        if now - self._last_summary >= self.summary_interval:
+            self._last_summary = now
+            self.print_summary()
+    
+    def dump(self, path: str):
+        """匯出統計，副檔名為 .csv 時輸出 CSV，否則輸出 JSON"""
+        summary = self.summary()
+        if path.lower().endswith('.csv'):
+            fields = ["count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(["stage"] + fields)
+                for stage, stats in summary.items():
+                    writer.writerow([stage] + [stats[field] for field in fields])
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({"timestamp": time.time(), "stages": summary}, f, ensure_ascii=False, indent=2)
+
+class PhaseDetector:
+    """以預先計算的區域特徵判斷遊戲階段
+
+    每個階段的特徵是所有階段指示器區域縮小後的 BGR 縮圖串接而成，
+    由少量已標記的截圖平均計算（calibrate）。判斷時一次計算目前畫面
+    與所有階段特徵的距離，信心為最近與次近距離的相對差距。
+    """
+    THUMBNAIL_SIZE = (8, 4)  # (寬, 高)
+
+    def __init__(self, phase_areas: Dict[GamePhase, Rect],
+                 signature_path: str = "phase_signatures.npz",
+                 min_confidence: float = 0.2):
+        self.phase_areas = phase_areas
+        self.signature_path = signature_path
+        self.min_confidence = min_confidence  # 低於此信心時視為無法判斷
+        self.phases: List[GamePhase] = []
+        self.signatures = np.zeros((0, 0), dtype=np.float32)  # (階段數 × 特徵長度)
+        if signature_path and os.path.exists(signature_path):
+            self.load(signature_path)
+    
+    @property
+    def calibrated(self) -> bool:
+        return len(self.phases) > 0
+    
+    def features(self, image: Union[Frame, np.ndarray]) -> np.ndarray:
+        """計算畫面的階段特徵向量"""
+        frame = image if isinstance(image, Frame) else Frame.full(image)
+        thumbnails = []
+        for phase in GamePhase:
+            rect = self.phase_areas.get(phase)
+            if rect is None:
+                continue
+            region = frame.crop(rect)
+            thumbnails.append(cv2.resize(region, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).ravel())
+        return np.concatenate(thumbnails).astype(np.float32) / 255.0
+    
+    def detect(self, image: Union[Frame, np.ndarray]) -> Tuple[Optional[GamePhase], float]:
+        """判斷階段，回傳 (階段, 信心)；尚未校正時回傳 (None, 0)"""
+        if not self.calibrated:
+            return None, 0.0
+        distances = np.linalg.norm(self.signatures - self.features(image), axis=1)
+        order = np.argsort(distances)
+        best = float(distances[order[0]])
+        if len(order) == 1:
+            return self.phases[order[0]], 1.0
+        second = float(distances[order[1]])
+        confidence = (second - best) / second if second > 0 else 0.0
+        return self.phases[order[0]], confidence
+    
+    def calibrate(self, labelled: Dict[GamePhase, List[Union[Frame, np.ndarray, str]]],
+                  save: bool = True):
+        """以已標記的截圖（畫面或 PNG 路徑）計算每個階段的特徵"""
+        phases = []
+        signatures = []
+        for phase, samples in labelled.items():
+            vectors = []
+            for sample in samples:
+                if isinstance(sample, str):
+                    image = cv2.imread(sample, cv2.IMREAD_COLOR)
+                    if image is None:
+                        print(f"無法讀取截圖: {sample}")
+                        continue
+                    sample = image
+                vectors.append(self.features(sample))
+            if vectors:
+                phases.append(phase)
+                signatures.append(np.mean(vectors, axis=0))
+        
+        self.phases = phases
+        self.signatures = np.array(signatures, dtype=np.float32)
+        if save and self.signature_path:
+            self.save(self.signature_path)
+    
+    def calibrate_from_dir(self, root: str, save: bool = True):
+        """從資料夾校正：root/<階段>/*.png，階段名稱可用 MOVE 或 移動"""
+        labelled = {}
+        for phase in GamePhase:
+            for name in (phase.name, phase.value):
+                paths = sorted(glob.glob(os.path.join(root, name, '*.png')))
+                if paths:
+                    labelled.setdefault(phase, []).extend(paths)
+        self.calibrate(labelled, save)
+    
+    def save(self, path: str):
+        np.savez(path, phases=np.array([phase.name for phase in self.phases]), signatures=self.signatures)
+    
+    def load(self, path: str):
+        data = np.load(path)
+        self.phases = [GamePhase[name] for name in data['phases']]
+        self.signatures = data['signatures'].astype(np.float32)
+
+class InputBackend:
+    """輸入後端基底類別 - 將畫面座標的點擊送到遊戲"""
+    def click(self, x: int, y: int):
+        raise NotImplementedError
+    
+    def wait(self, seconds: float):
+        """兩個連續輸入事件之間的等待"""
+        if seconds > 0:
+            time.sleep(seconds)
+
+class PyAutoGUIBackend(InputBackend):
+    """以 pyautogui 移動滑鼠並點擊"""
+    def click(self, x: int, y: int):
+        require_pyautogui().click(x, y)
+
+class RecordingInputBackend(InputBackend):
+    """乾跑輸入後端 - 只記錄每次點擊的時間與座標，不移動滑鼠
+
+    可在沒有顯示環境的 Linux 上測試與量測動作延遲；
+    on_click 可用來讓模擬的畫面來源對點擊做出反應。
+    realtime 為 False 時事件之間不實際等待。
+    """
+    def __init__(self, on_click: Optional[Callable[[int, int], None]] = None,
+                 realtime: bool = True):
+        self.on_click = on_click
+        self.realtime = realtime
+        self.events: List[Tuple[float, int, int]] = []  # (time.perf_counter(), x, y)
+        self._lock = threading.Lock()
+    
+    def click(self, x: int, y: int):
+        with self._lock:
+            self.events.append((time.perf_counter(), x, y))
+        if self.on_click is not None:
+            self.on_click(x, y)
+    
+    def wait(self, seconds: float):
+        if self.realtime:
+            super().wait(seconds)
+    
+    def intervals(self) -> List[float]:
+        """相鄰兩次點擊之間的間隔（秒）"""
+        times = [event[0] for event in self.events]
+        return [later - earlier for earlier, later in zip(times, times[1:])]
+    
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+    
+    def dump(self, path: str):
+        """匯出點擊紀錄（CSV）"""
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "x", "y"])
+            writer.writerows(self.events)
+
+@dataclass
+class InputAction:
+    """動作序列中的一個點擊"""
+    kind: str  # "flip" 或 "play"
+    card: Card
+    point: Tuple[int, int]
+    watch_rect: Rect  # 點擊後應出現變化的區域
+    plan_index: int = 0  # 屬於第幾個需求
+
+class ActionExecutor:
+    """動作執行器 - 點擊後高頻輪詢卡牌附近區域，直到畫面出現預期變化
+
+    取代固定的等待時間：每個動作只等待遊戲實際需要的時間，
+    逾時仍未變化時重試點擊，全部失敗時回傳 False。
+    注意重試前會等到逾時，逾時應設定得比遊戲動畫時間長。
+    點擊座標為畫面座標，實際點擊時會加上 origin（視窗左上角）。
+    """
+    def __init__(self, frame_source: FrameSource,
+                 timeout: float = 1.0,
+                 poll_interval: float = 0.01,
+                 retries: int = 1,
+                 change_threshold: float = 12.0,
+                 metrics: Optional[StageMetrics] = None,
+                 origin: Tuple[int, int] = (0, 0),
+                 input_backend: Optional[InputBackend] = None,
+                 event_interval: float = 0.03):
+        self.frame_source = frame_source
+        self.metrics = metrics or StageMetrics()
+        self.input_backend = input_backend or PyAutoGUIBackend()
+        self.origin = origin
+        self.event_interval = event_interval  # 動作序列中兩次點擊之間的最短間隔（秒）
+        self.timeout = timeout  # 每次點擊等待畫面變化的最長時間（秒）
+        self.poll_interval = poll_interval  # 輪詢間隔（秒）
+        self.retries = retries  # 逾時後重新點擊的次數
+        self.change_threshold = change_threshold  # 平均灰階差超過此值視為畫面已變化
+    
+    def click(self, x: int, y: int):
+        screen_x, screen_y = x + self.origin[0], y + self.origin[1]
+        with self.metrics.time("click"):
+            self.input_backend.click(screen_x, screen_y)
+    
+    def snapshot(self, rect: Rect) -> Optional[np.ndarray]:
+        """擷取指定區域的灰階影像（複本）"""
+        snapshots = self.snapshot_many([rect])
+        return snapshots[0] if snapshots is not None else None
+    
+    def snapshot_many(self, rects: List[Rect]) -> Optional[List[np.ndarray]]:
+        """以一次擷取取得多個區域的灰階影像（複本）"""
+        frame = self.frame_source.snapshot(list(rects))
+        if frame is None:
+            return None
+        return [to_gray(frame.crop(rect)).copy() for rect in rects]
+    
+    def region_changed(self, before: np.ndarray, current: np.ndarray) -> bool:
+        """區域是否與點擊前明顯不同"""
+        if before.shape != current.shape:
+            return True
+        return float(cv2.absdiff(before, current).mean()) > self.change_threshold
+    
+    def click_and_confirm(self, point: Tuple[int, int], watch_rect: Rect) -> bool:
+        """點擊並等待 watch_rect 區域出現變化，回傳是否確認成功"""
+        before = self.snapshot(watch_rect)
+        if before is None:
+            self.click(*point)
+            return False
+        
+        for attempt in range(self.retries + 1):
+            self.click(*point)
+            waited_from = time.perf_counter()
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                current = self.snapshot(watch_rect)
+                if current is None:
+                    return False
+                if self.region_changed(before, current):
+                    self.metrics.record("confirm_wait", time.perf_counter() - waited_from)
+                    return True
+                time.sleep(self.poll_interval)
+            self.metrics.record("confirm_timeout", time.perf_counter() - waited_from)
+            
+            if attempt < self.retries:
+                print(f"點擊 {point} 後畫面沒有變化，重試")
+        
+        print(f"點擊 {point} 失敗：畫面沒有變化")
+        return False
+    
+    def run_sequence(self, actions: List[InputAction]) -> List[bool]:
+        """連續送出一串點擊，最後一起等待確認，回傳每個動作是否確認成功
+
+        點擊之間只間隔 event_interval，不逐一等待畫面變化；
+        所有點擊送出後才輪詢各動作的 watch_rect，逾時未變化的動作會重新點擊。
+        同一序列中的動作應監看不同的區域。
+        """
+        if not actions:
+            return []
+        rects = [action.watch_rect for action in actions]
+        before = self.snapshot_many(rects)
+        confirmed = [False] * len(actions)
+        if before is None:
+            return confirmed
+        
+        pending = list(range(len(actions)))
+        for attempt in range(self.retries + 1):
+            with self.metrics.time("sequence_dispatch"):
+                for order, index in enumerate(pending):
+                    if order:
+                        self.input_backend.wait(self.event_interval)
+                    self.click(*actions[index].point)
+            
+            waited_from = time.perf_counter()
+            deadline = time.monotonic() + self.timeout
+            while pending and time.monotonic() < deadline:
+                current = self.snapshot_many([rects[index] for index in pending])
+                if current is None:
+                    return confirmed
+                still_pending = []
+                for index, image in zip(pending, current):
+                    if self.region_changed(before[index], image):
+                        confirmed[index] = True
+                    else:
+                        still_pending.append(index)
+                pending = still_pending
+                if pending:
+                    time.sleep(self.poll_interval)
+            
+            if not pending:
+                self.metrics.record("confirm_wait", time.perf_counter() - waited_from)
+                return confirmed
+            self.metrics.record("confirm_timeout", time.perf_counter() - waited_from)
+            if attempt < self.retries:
+                print(f"{len(pending)} 個點擊後畫面沒有變化，重試")
+        
+        for index in pending:
+            print(f"點擊 {actions[index].point} 失敗：畫面沒有變化")
+        return confirmed
+
+class HandStateTracker:
+    """持續的手牌狀態模型 - 以動作的已知效果更新，並以畫面抽查確認
+
+    翻面、出牌成功後直接更新模型（切換目前的面、移除打出的卡牌、
+    後方卡牌往前遞補位置）。下一次同步時只逐張比對卡牌縮圖，
+    卡牌數量或外觀與模型不符時才完整重新識別整副手牌。
+
+    縮圖只取符號與數值所在的中間一半，正規化亮度與對比後以小區塊比較，
+    因此只改變一個數值字形也會被偵測到。定位到的矩形會差一兩個像素，
+    比較時容許 MAX_SHIFT 像素以內的位移。合成畫面中同一張卡牌（含出牌後
+    往前遞補的卡牌）的差異在 0.2 以下，只改數值的卡牌至少約 0.4。
+    """
+    THUMBNAIL_SIZE = (64, 60)  # (寬, 高)，預設卡牌中間一半（左右內縮）的原始解析度
+    BLOCK_SIZE = 8
+    MAX_SHIFT = 2
+
+    def __init__(self, bot: "UnlightBot", match_threshold: float = 0.3):
+        self.bot = bot
+        self.match_threshold = match_threshold  # 任一區塊的正規化平均差超過此值視為不符
+        offsets = range(-self.MAX_SHIFT, self.MAX_SHIFT + 1)
+        self._shifts = sorted(((dy, dx) for dy in offsets for dx in offsets), key=lambda s: abs(s[0]) + abs(s[1]))
+        self.cards: List[Card] = []
+        self._thumbnails: List[Optional[np.ndarray]] = []  # None 表示動作後外觀未知，下次同步時直接採用
+        self.full_scans = 0
+        self.verified_syncs = 0
+        self._lock = threading.Lock()
+    
+    def reset(self):
+        with self._lock:
+            self.cards = []
+            self._thumbnails = []
+    
+    def _thumbnail(self, hand_gray: np.ndarray, origin: Tuple[int, int], rect: Rect,
+                   size: Tuple[int, int]) -> np.ndarray:
+        # 定位到的矩形寬高會隨內容差幾個像素，因此以矩形中心取固定大小（完整識別時
+        # 定位到的卡牌大小）的區域，左右再內縮一些，讓位置偏差時不會把卡牌邊框外的背景算進來
+        w, h = size
+        x = rect[0] - origin[0] + rect[2] // 2 - w // 2 + w // 10
+        y = rect[1] - origin[1] + rect[3] // 2 - h // 2
+        region = hand_gray[max(0, y + h // 4):y + h - h // 4, max(0, x):x + w - 2 * (w // 10)]
+        if region.size == 0:
+            return np.zeros(self.THUMBNAIL_SIZE[::-1], dtype=np.float32)
+        thumbnail = cv2.resize(region, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+        return (thumbnail - thumbnail.mean()) / max(float(thumbnail.std()), 1.0)
+    
+    def _matches(self, current: np.ndarray, expected: np.ndarray) -> bool:
+        """兩張縮圖在某個位移下，每個區塊的平均差都不超過門檻（由小位移開始嘗試）"""
+        height, width = current.shape
+        block = self.BLOCK_SIZE
+        for dy, dx in self._shifts:
+            a = current[max(0, dy):height + min(0, dy), max(0, dx):width + min(0, dx)]
+            b = expected[max(0, -dy):height + min(0, -dy), max(0, -dx):width + min(0, -dx)]
+            diff = np.abs(a - b)
+            blocks = cv2.resize(diff, (max(1, diff.shape[1] // block), max(1, diff.shape[0] // block)),
+                                interpolation=cv2.INTER_AREA)
+            if float(blocks.max()) <= self.match_threshold:
+                return True
+        return False
+    
+    def sync(self, frame: Frame) -> List[Card]:
+        """讓模型與畫面一致，回傳目前的手牌"""
+        bot = self.bot
+        origin = (bot.hand_area[0], bot.hand_area[1])
+        hand_gray = to_gray(frame.crop(bot.hand_area))
+        with self._lock:
+            if self.cards:
+                with bot.metrics.time("hand_verify"):
+                    verified = self._verify(hand_gray, origin, bot.locate_cards(hand_gray))
+                if verified:
+                    self.verified_syncs += 1
+                    return list(self.cards)
+            
+            # 沒有模型或抽查不符時完整重新識別
+            cards = bot.scan_hand_cards(frame)
+            self.full_scans += 1
+            self.cards = cards
+            self._thumbnails = [self._thumbnail(hand_gray, origin, bot.card_rect(card), card.size or bot.card_size)
+                                for card in cards]
+            return list(cards)
+    
+    def _verify(self, hand_gray: np.ndarray, origin: Tuple[int, int], rects: List[Rect]) -> bool:
+        """逐張比對模型與畫面，全部相符時更新卡牌位置與縮圖"""
+        if len(rects) != len(self.cards):
+            return False
+        thumbnails = []
+        for card, rect, expected in zip(self.cards, rects, self._thumbnails):
+            current = self._thumbnail(hand_gray, origin, rect, card.size or self.bot.card_size)
+            if expected is not None and not self._matches(current, expected):
+                return False
+            thumbnails.append(current)
+        
+        # 卡牌大小維持完整識別時定位到的值，縮圖的取樣範圍才不會隨定位誤差漂移
+        for card, (card_x, card_y, card_width, card_height) in zip(self.cards, rects):
+            card.position = (card_x + card_width // 2, card_y + card_height // 2)
+            card.center_position = card.position
+        self._thumbnails = thumbnails
+        return True
+    
+    def _index_of(self, card: Card) -> Optional[int]:
+        for index, known in enumerate(self.cards):
+            if known is card:
+                return index
+        return None
+    
+    def apply_flip(self, card: Card):
+        """卡牌已翻面（current_side 已由 flip_card 切換），外觀待下次同步時採用"""
+        with self._lock:
+            index = self._index_of(card)
+            if index is not None:
+                self._thumbnails[index] = None
+    
+    def apply_play(self, card: Card):
+        """卡牌已打出：從模型移除，後方卡牌往前遞補位置"""
+        with self._lock:
+            index = self._index_of(card)
+            if index is None:
+                return
+            positions = [(known.position, known.center_position) for known in self.cards]
+            del self.cards[index]
+            del self._thumbnails[index]
+            for later in range(index, len(self.cards)):
+                self.cards[later].position, self.cards[later].center_position = positions[later]
+
+RECORDING_MAGIC = b"ULREC1\n"
+
+def plan_to_dict(plan: RequirementPlan, cards: List[Card]) -> dict:
+    """將計畫轉換為字典，出牌以卡牌在 cards 中的索引表示"""
+    plays = []
+    for play in plan.plays:
+        index = next((i for i, card in enumerate(cards) if card is play.card), -1)
+        plays.append({"card": index, "flip": play.flip, "value": play.value})
+    return {"symbol": plan.symbol.name, "target": plan.target, "plays": plays}
+
+class SessionRecorder:
+    """對局錄製器 - 將擷取的區域、識別結果、計畫與耗時寫入只能附加的檔案
+
+    畫面只保存手牌與階段指示器區域，與前一張畫面做 XOR 差分後以 zlib 壓縮，
+    每 keyframe_interval 張保存一次完整畫面。壓縮與寫檔都在背景執行緒，
+    主循環只複製區域影像；佇列已滿時捨棄該筆紀錄而不阻塞主循環。
+
+    檔案格式：開頭為 RECORDING_MAGIC，之後每筆紀錄為
+    類型(1 位元組) + 長度(4 位元組) + 內容。'F' 為畫面（JSON 標頭 + 壓縮資料），
+    'D' 為決策（JSON）。
+    """
+    def __init__(self, path: str, keyframe_interval: int = 30,
+                 queue_size: int = 64, compression_level: int = 1):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.compression_level = compression_level
+        self.frames_recorded = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=queue_size)
+        self._previous: Dict[Tuple[int, ...], np.ndarray] = {}
+        self._since_keyframe = 0
+        self._last_cards: List[Card] = []
+        self._last_frame_index: Optional[int] = None  # 最近一張成功放入佇列的畫面
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(RECORDING_MAGIC)
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+    
+    def _put(self, item: tuple) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def record_frame(self, frame: Frame, rois: List[Rect], cards: List[Card],
+                     phase: GamePhase, phase_confidence: float = 0.0):
+        """記錄一張畫面與其識別結果"""
+        header = {
+            "index": frame.index,
+            "timestamp": frame.timestamp,
+            "cards": [card.to_dict() for card in cards],
+            "phase": phase.name,
+            "phase_confidence": phase_confidence,
+        }
+        regions = [(tuple(rect), np.ascontiguousarray(frame.crop(rect)).copy()) for rect in rois]
+        self._last_cards = list(cards)
+        if self._put(("F", header, regions)):
+            self.frames_recorded += 1
+            self._last_frame_index = frame.index
+        else:
+            self._last_frame_index = None
+    
+    def record_decision(self, frame_index: int, plans: List[RequirementPlan],
+                        timings: Dict[str, float]):
+        """記錄畫面對應的計畫與各階段耗時（秒）；該畫面已被捨棄時不記錄"""
+        if frame_index != self._last_frame_index:
+            return
+        record = {
+            "frame": frame_index,
+            "plans": [plan_to_dict(plan, self._last_cards) for plan in plans],
+            "timings": timings,
+        }
+        self._put(("D", record))
+    
+    def _encode_frame(self, header: dict, regions: List[Tuple[Rect, np.ndarray]]) -> bytes:
+        keyframe = (self._since_keyframe == 0 or
+                    any(self._previous.get(rect) is None or self._previous[rect].shape != array.shape
+                        for rect, array in regions))
+        self._since_keyframe = (0 if keyframe else self._since_keyframe) + 1
+        if self._since_keyframe >= self.keyframe_interval:
+            self._since_keyframe = 0
+        
+        blobs = []
+        header = dict(header, keyframe=keyframe, regions=[])
+        for rect, array in regions:
+            data = array if keyframe else np.bitwise_xor(array, self._previous[rect])
+            blob = zlib.compress(data.tobytes(), self.compression_level)
+            header["regions"].append({"rect": list(rect), "shape": list(array.shape),
+                                      "dtype": str(array.dtype), "size": len(blob)})
+            blobs.append(blob)
+            self._previous[rect] = array
+        header_bytes = json.dumps(header).encode('utf-8')
+        return struct.pack('<I', len(header_bytes)) + header_bytes + b"".join(blobs)
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if item[0] == "F":
+                    payload = self._encode_frame(item[1], item[2])
+                else:
+                    payload = json.dumps(item[1]).encode('utf-8')
+                self._file.write(item[0].encode('ascii') + struct.pack('<I', len(payload)) + payload)
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                print(f"錄製錯誤: {e}")
+        self._file.flush()
+    
+    def close(self):
+        """寫完佇列中的紀錄後關閉檔案"""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+@dataclass
+class RecordedFrame:
+    """錄製檔中的一張畫面與當時的識別結果"""
+    frame: Frame
+    cards: List[Card]
+    phase: GamePhase
+    phase_confidence: float
+    decision: Optional[dict] = None  # 對應的 'D' 紀錄（沒有時為 None）
+
+def read_recording(path: str) -> Iterator[RecordedFrame]:
+    """依序讀出錄製檔中的畫面（檔案結尾不完整時停止）"""
+    previous: Dict[Tuple[int, ...], np.ndarray] = {}
+    pending: Optional[RecordedFrame] = None
+    with open(path, 'rb') as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"不是錄製檔: {path}")
+        while True:
+            head = f.read(5)
+            if len(head) < 5:
+                break
+            kind = head[:1]
+            length = struct.unpack('<I', head[1:])[0]
+            payload = f.read(length)
+            if len(payload) < length:
+                break
+            
+            if kind == b"D":
+                # 只附加到對應的畫面（該畫面被捨棄時略過）
+                decision = json.loads(payload)
+                if pending is not None and decision.get("frame") == pending.frame.index:
+                    pending.decision = decision
+                continue
+            if kind != b"F":
+                continue
+            
+            if pending is not None:
+                yield pending
+            header_length = struct.unpack('<I', payload[:4])[0]
+            header = json.loads(payload[4:4 + header_length])
+            offset = 4 + header_length
+            regions = []
+            for region in header["regions"]:
+                rect = tuple(region["rect"])
+                data = zlib.decompress(payload[offset:offset + region["size"]])
+                offset += region["size"]
+                array = np.frombuffer(data, dtype=region["dtype"]).reshape(region["shape"])
+                if not header["keyframe"]:
+                    array = np.bitwise_xor(array, previous[rect])
+                previous[rect] = array
+                regions.append((rect, array))
+            pending = RecordedFrame(
+                frame=Frame(regions, header["index"], header["timestamp"]),
+                cards=[Card.from_dict(card) for card in header["cards"]],
+                phase=GamePhase[header["phase"]],
+                phase_confidence=header.get("phase_confidence", 0.0))
+    if pending is not None:
+        yield pending
+
+class RecordedFrameSource(FrameSource):
+    """以錄製檔作為畫面來源（只包含錄製時的區域，不限速）"""
+    def __init__(self, path: str):
+        self.path = path
+        self._records = read_recording(path)
+        self._first = next(self._records, None)
+        self._current: Optional[Frame] = None
+        self._lock = threading.Lock()
+    
+    def size(self) -> Tuple[int, int]:
+        if self._first is None:
+            return (0, 0)
+        rects = [rect for rect, _ in self._first.frame.regions]
+        return max(x + w for x, _, w, _ in rects), max(y + h for _, y, _, h in rects)
+    
+    def next_record(self) -> Optional[RecordedFrame]:
+        with self._lock:
+            if self._first is not None:
+                record, self._first = self._first, None
+                return record
+            return next(self._records, None)
+    
+    def grab(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        record = self.next_record()
+        if record is None:
+            return None
+        self._current = record.frame
+        return record.frame
+    
+    def snapshot(self, rois: Optional[List[Rect]] = None) -> Optional[Frame]:
+        with self._lock:
+            if self._current is not None:
+                return self._current
+            return self._first.frame if self._first is not None else None
+
+class SessionReplayer:
+    """將錄製檔重新送入識別與求解，比對結果與錄製時是否相同
+
+    不執行任何點擊，也不等待，因此比實際對局快得多；
+    可用來離線分析耗時或作為真實對局的回歸測試。
+    """
+    def __init__(self, path: str, bot: Optional["UnlightBot"] = None):
+        self.source = RecordedFrameSource(path)
+        self.bot = bot or UnlightBot(self.source, input_backend=RecordingInputBackend(realtime=False))
+    
+    def run(self) -> Dict[str, object]:
+        """回放整個錄製檔，回傳統計與不一致的畫面"""
+        bot = self.bot
+        frames = 0
+        card_mismatches = []
+        plan_mismatches = []
+        recorded_times = []
+        replay_times = []
+        start = time.perf_counter()
+        
+        while True:
+            record = self.source.next_record()
+            if record is None:
+                break
+            frames += 1
+            bot.metrics.take_current()
+            turn_start = time.perf_counter()
+            cards = bot.scan_hand_cards(record.frame)
+            phase = bot.detect_game_phase(record.frame)
+            plans = bot.plan_requirements(bot.phase_requirements.get(phase, []), phase, cards)
+            replay_times.append(time.perf_counter() - turn_start)
+            
+            # 以目前的面與另一面比較（手牌模型翻面後 current_side 會與重新識別不同）
+            recorded_faces = [(c.get_current_symbol(), c.get_current_value(), c.get_other_symbol(), c.get_other_value())
+                              for c in record.cards]
+            faces = [(c.get_current_symbol(), c.get_current_value(), c.get_other_symbol(), c.get_other_value())
+                     for c in cards]
+            if faces != recorded_faces:
+                card_mismatches.append(record.frame.index)
+            if record.decision is not None:
+                recorded_times.append(sum(record.decision["timings"].values()))
+                if [plan_to_dict(plan, cards) for plan in plans] != record.decision["plans"]:
+                    plan_mismatches.append(record.frame.index)
+        
+        elapsed = time.perf_counter() - start
+        return {
+            "frames": frames,
+            "card_mismatches": card_mismatches,
+            "plan_mismatches": plan_mismatches,
+            "replay_frames_per_sec": frames / elapsed if elapsed > 0 else 0.0,
+            "replay_p95_ms": float(np.percentile(replay_times, 95)) * 1000 if replay_times else 0.0,
+            "recorded_p95_ms": float(np.percentile(recorded_times, 95)) * 1000 if recorded_times else 0.0,
+        }
+
+DEFAULT_REQUIREMENTS_TEXT = """# Unlight 階段需求配置
+# 格式：階段名稱：
+#       符號+數值 符號+數值
+# 符號：移(移動) 劍(劍) 槍(槍) 盾(盾牌) 特(特殊)
+
+移動：
+移1
+
+攻擊：
+劍3 特3
+
+防守：
+盾4
+"""
 
 class UnlightBot:
-    def __init__(self):
+    def __init__(self, frame_source: Optional[FrameSource] = None,
+                 input_backend: Optional[InputBackend] = None):
         self.cards: List[Card] = []
         self.current_phase = GamePhase.DEAL
-        self.screen_width, self.screen_height = pyautogui.size()
+        self.frame_source = frame_source or ScreenFrameSource()
+        self.screen_width, self.screen_height = self.frame_source.size()
         self.phase_requirements = {}  # 階段需求配置
+        self.requirements_path = 'phase_requirements.txt'
+        self.requirements_reloads = 0
+        self.requirements_error: Optional[str] = None  # 最近一次載入失敗的原因
+        self._requirements_mtime: Optional[float] = None
         
-        # 設定安全機制
-        pyautogui.FAILSAFE = True
-        pyautogui.PAUSE = 0.1
+        # 各階段耗時統計
+        self.metrics = StageMetrics()
+        self.profile_next_tick = False  # 設為 True 時以 cProfile 分析下一回合
+        
+        # 可選的對局錄製（見 run_auto_play 的 record_path）
+        self.recorder: Optional[SessionRecorder] = None
+        self.last_plans: List[RequirementPlan] = []
+        self._recorded_frame: Optional[int] = None
+        
+        # 點擊後確認畫面變化的動作執行器
+        self.action_executor = ActionExecutor(self.frame_source, metrics=self.metrics,
+                                              input_backend=input_backend)
+        self.batch_actions = True  # 將規劃結果編譯成動作序列，連續點擊後一起確認
         
         # 預設的卡牌區域（需要根據實際遊戲調整）
         self.hand_area = (100, 600, 800, 150)  # (x, y, width, height)
         
-        # 載入階段需求配置
-        self.load_phase_requirements()
-    
-    def capture_screen(self) -> np.ndarray:
-        """截取螢幕畫面"""
-        screenshot = pyautogui.screenshot()
-        return cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
-    
-    def detect_game_phase(self, image: np.ndarray) -> GamePhase:
-        """檢測當前遊戲階段"""
-        # 這裡需要根據遊戲UI的特徵來判斷階段
-        # 例如：檢測特定的階段指示器顏色或文字
+        # 卡牌尺寸與間距（dynamic_layout 為 False 時假設卡牌按固定間距排列）
+        self.card_size = (80, 120)  # (width, height)
+        self.card_spacing = 90
         
-        # 示例：檢測階段指示器（需要根據實際遊戲調整）
-        phase_areas = {
+        # 動態定位並追蹤手牌位置，不依賴固定的卡牌間距
+        self.dynamic_layout = True
+        self.card_locator = CardLocator()
+        
+        # 持續的手牌模型，回合之間只抽查畫面而不是每次完整重新識別
+        self.track_hand_state = True
+        self.hand_tracker = HandStateTracker(self)
+        
+        # 階段指示器區域（需要根據實際遊戲調整）
+        self.phase_areas = {
             GamePhase.DEAL: (50, 50, 100, 30),
             GamePhase.MOVE: (150, 50, 100, 30),
             GamePhase.ATTACK: (250, 50, 100, 30),
             GamePhase.DEFEND: (350, 50, 100, 30)
         }
         
-        # 簡化示例，實際需要圖像識別
-        return GamePhase.MOVE  # 預設返回移動階段
+        # 每回合只擷取手牌與階段指示器區域，而不是整個螢幕
+        self.roi_capture = True
+        
+        # 階段判斷（需要先以已標記的截圖校正，見 PhaseDetector.calibrate）
+        self.phase_detector = PhaseDetector(self.phase_areas)
+        self.phase_confidence = 0.0
+        
+        # 共用的符號模板庫（只在啟動與檔案變更時讀取磁碟）
+        self.template_bank = TemplateBank.shared(scales=DEFAULT_TEMPLATE_SCALES)
+        self.symbol_matcher = PyramidSymbolMatcher(self.template_bank)
+        self.digit_recognizer = DigitRecognizer.shared()
+        
+        # 卡牌指紋快取，畫面沒變的位置不需要重新識別
+        self.recognition_cache = RecognitionCache()
+        
+        # 出牌計畫快取，相同的手牌與需求不需要重新求解
+        self.plan_cache = PlanCache()
+        
+        # 可選的識別執行緒池（OpenCV 運算時會釋放 GIL）
+        self.recognition_pool: Optional[ThreadPoolExecutor] = None
+        self.recognition_workers = 1
+        
+        # 載入階段需求配置
+        self.load_phase_requirements()
+    
+    def capture_screen(self) -> np.ndarray:
+        """截取螢幕畫面（畫面來源已結束時拋出錯誤）"""
+        with self.metrics.time("capture"):
+            frame = self.frame_source.grab()
+        if frame is None:
+            raise RuntimeError("畫面來源已結束")
+        return frame.image
+    
+    def capture_rois(self) -> List[Rect]:
+        """每回合需要擷取的區域"""
+        return [self.hand_area, union_rect(list(self.phase_areas.values()))]
+    
+    def grab_frame(self) -> Optional[Frame]:
+        """擷取一次畫面，供同一回合的所有步驟共用（來源結束時回傳 None）"""
+        with self.metrics.time("capture"):
+            return self.frame_source.grab(self.capture_rois() if self.roi_capture else None)
+    
+    def detect_game_phase(self, image: Union[Frame, np.ndarray]) -> GamePhase:
+        """檢測當前遊戲階段"""
+        # 比對 self.phase_areas 中階段指示器的顏色特徵
+        with self.metrics.time("phase_detect"):
+            phase, self.phase_confidence = self.phase_detector.detect(image)
+        
+        if phase is None:
+            # 尚未校正時預設返回移動階段
+            return GamePhase.MOVE
+        if self.phase_confidence < self.phase_detector.min_confidence:
+            # 信心不足時沿用上一個階段
+            return self.current_phase
+        return phase
     
     def detect_card_symbol(self, card_image: np.ndarray) -> Tuple[CardSymbol, int]:
         """識別卡牌符號和數值"""
         # 這裡需要實現圖像識別邏輯
         # 可以使用模板匹配或者訓練的機器學習模型
         
-        # 示例：使用模板匹配識別符號
-        symbols = {
-            CardSymbol.MOVE: "move_template.png",
-            CardSymbol.SHIELD: "shield_template.png",
-            CardSymbol.SWORD: "sword_template.png",
-            CardSymbol.GUN: "gun_template.png",
-            CardSymbol.SPECIAL: "special_template.png"
-        }
-        
-        best_match = CardSymbol.MOVE
-        best_score = 0
-        
-        for symbol, template_path in symbols.items():
-            try:
-                # 載入模板（需要預先準備符號的模板圖片）
-                template = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
-                if template is not None:
-                    card_gray = cv2.cvtColor(card_image, cv2.COLOR_BGR2GRAY)
-                    result = cv2.matchTemplate(card_gray, template, cv2.TM_CCOEFF_NORMED)
-                    _, max_val, _, _ = cv2.minMaxLoc(result)
-                    
-                    if max_val > best_score:
-                        best_score = max_val
-                        best_match = symbol
-            except:
-                continue
+        # 使用預先載入的模板庫進行批次模板匹配（單一區域）
+        card_gray = to_gray(card_image)
+        scores = self.symbol_matcher.score_regions([card_gray])
+        best_match, _ = self.symbol_matcher.classify(scores)[0]
         
         # 識別數值（需要OCR或者數字模板匹配）
         value = self.extract_card_value(card_image)
@@ -113,156 +2215,242 @@ class UnlightBot:
     
     def extract_card_value(self, card_image: np.ndarray) -> int:
         """提取卡牌數值"""
-        # 這裡可以使用OCR或者數字模板匹配
-        # 示例：使用pytesseract進行OCR
-        try:
-            import pytesseract
-            gray = cv2.cvtColor(card_image, cv2.COLOR_BGR2GRAY)
-            text = pytesseract.image_to_string(gray, config='--psm 8 -c tessedit_char_whitelist=0123456789')
-            return int(text.strip()) if text.strip().isdigit() else 1
-        except:
-            return 1  # 預設值
+        # 使用程序內數字識別，信心不足時才使用 tesseract
+        return self.digit_recognizer.recognize(to_gray(card_image)).value
     
-    def scan_hand_cards(self) -> List[Card]:
-        """掃描手牌"""
-        image = self.capture_screen()
+    def scan_hand_cards(self, frame: Optional[Frame] = None) -> List[Card]:
+        """掃描手牌（未提供畫面時自行擷取）"""
+        if frame is None:
+            frame = self.grab_frame()
         cards = []
         
         # 在手牌區域尋找卡牌
         x, y, w, h = self.hand_area
-        hand_region = image[y:y+h, x:x+w]
+        hand_region = frame.crop(self.hand_area)
+        
+        # 整個手牌區域只轉換一次灰階
+        hand_gray = to_gray(hand_region)
         
-        # 假設卡牌按固定間距排列
-        card_width = 80
-        card_height = 120
-        card_spacing = 90
+        if self.dynamic_layout:
+            # 追蹤卡牌位置，只處理實際存在的卡牌
+            with self.metrics.time("locate"):
+                card_rects = self.card_locator.track(hand_gray, (x, y))
+        else:
+            card_rects = self.fixed_card_rects()
         
-        for i in range(6):  # 假設最多6張手牌
-            card_x = x + i * card_spacing
-            card_y = y + 10
+        slots = []  # [卡牌矩形, 識別結果]，識別結果為 None 表示待識別
+        pending = []  # (slots 索引, 指紋)
+        regions = []  # 依序為每張待識別卡牌的上半部與旋轉後的下半部
+        
+        for card_rect in card_rects:
+            card_x, card_y, card_width, card_height = card_rect
+            local_x = card_x - x
+            local_y = card_y - y
+            card_gray = hand_gray[local_y:local_y+card_height, local_x:local_x+card_width]
             
-            if card_x + card_width > x + w:
-                break
+            # 指紋沒變的位置直接使用快取結果
+            fingerprint = card_fingerprint(card_gray)
+            found, faces = self.recognition_cache.lookup(fingerprint)
+            if found:
+                if faces is not None:
+                    slots.append([card_rect, faces])
+                continue
             
-            card_image = image[card_y:card_y+card_height, card_x:card_x+card_width]
+            # 固定間距時需檢查是否有卡牌（可以通過檢測卡牌邊框或特徵）
+            if not self.dynamic_layout and not self.has_card_at_position(card_gray):
+                self.recognition_cache.put(fingerprint, None)
+                continue
             
-            # 檢查是否有卡牌（可以通過檢測卡牌邊框或特徵）
-            if self.has_card_at_position(card_image):
-                # 識別卡牌上下兩面（類似撲克牌結構）
-                # 上半部分是正面，下半部分是反面（上下顛倒）
-                card_height_quarter = card_height // 4
-                top_region = card_image[card_height_quarter:card_height//2, :]
-                bottom_region = card_image[card_height//2:card_height-card_height_quarter, :]
-                
-                # 下半部分需要旋轉180度來識別
-                bottom_region_rotated = cv2.rotate(bottom_region, cv2.ROTATE_180)
-                
-                top_symbol, top_value = self.detect_card_symbol(top_region)
-                bottom_symbol, bottom_value = self.detect_card_symbol(bottom_region_rotated)
-                
-                # 計算中央切換區域（卡牌中央小區域）
-                center_x = card_x + card_width // 2
-                center_y = card_y + card_height // 2
-                
-                card = Card(
-                    position=(card_x + card_width//2, card_y + card_height//2),
-                    center_position=(center_x, center_y),
-                    top_symbol=top_symbol,
-                    top_value=top_value,
-                    bottom_symbol=bottom_symbol,
-                    bottom_value=bottom_value
-                )
-                cards.append(card)
+            # 識別卡牌上下兩面（類似撲克牌結構）
+            # 上半部分是正面，下半部分是反面（上下顛倒）
+            card_height_quarter = card_height // 4
+            top_region = card_gray[card_height_quarter:card_height//2, :]
+            bottom_region = card_gray[card_height//2:card_height-card_height_quarter, :]
+            
+            # 下半部分需要旋轉180度來識別
+            bottom_region_rotated = cv2.rotate(bottom_region, cv2.ROTATE_180)
+            
+            pending.append((len(slots), fingerprint))
+            slots.append([card_rect, None])
+            regions.extend([top_region, bottom_region_rotated])
+        
+        # 只有指紋改變的卡牌需要完整識別；信心不足的結果不存入快取，下次重新識別
+        if regions:
+            for (slot_index, fingerprint), recognized in zip(pending, self.recognize_card_faces(regions)):
+                slots[slot_index][1] = recognized
+                if recognized[1] >= self.digit_recognizer.min_confidence:
+                    self.recognition_cache.put(fingerprint, recognized)
+        
+        for (card_x, card_y, card_width, card_height), (faces, confidence) in slots:
+            top_symbol, top_value, bottom_symbol, bottom_value = faces
+            if confidence < self.digit_recognizer.min_confidence:
+                print(f"卡牌 {(card_x, card_y)} 識別信心不足 ({confidence:.2f})")
+            
+            # 計算中央切換區域（卡牌中央小區域）
+            center_x = card_x + card_width // 2
+            center_y = card_y + card_height // 2
+            
+            card = Card(
+                position=(card_x + card_width//2, card_y + card_height//2),
+                center_position=(center_x, center_y),
+                top_symbol=top_symbol,
+                top_value=top_value,
+                bottom_symbol=bottom_symbol,
+                bottom_value=bottom_value,
+                size=(card_width, card_height),
+                confidence=confidence
+            )
+            cards.append(card)
         
         return cards
     
+    def locate_cards(self, hand_gray: np.ndarray) -> List[Rect]:
+        """找出手牌區域中實際有卡牌的位置"""
+        x, y, _, _ = self.hand_area
+        if self.dynamic_layout:
+            with self.metrics.time("locate"):
+                return self.card_locator.track(hand_gray, (x, y))
+        rects = []
+        for rect in self.fixed_card_rects():
+            card_x, card_y, card_width, card_height = rect
+            card_gray = hand_gray[card_y-y:card_y-y+card_height, card_x-x:card_x-x+card_width]
+            if self.has_card_at_position(card_gray):
+                rects.append(rect)
+        return rects
+    
+    def fixed_card_rects(self) -> List[Rect]:
+        """固定間距排列時的卡牌位置（假設最多6張手牌）"""
+        x, y, w, h = self.hand_area
+        card_width, card_height = self.card_size
+        rects = []
+        for i in range(6):
+            card_x = x + i * self.card_spacing
+            if card_x + card_width > x + w:
+                break
+            rects.append((card_x, y + 10, card_width, card_height))
+        return rects
+    
+    def set_recognition_pool(self, pool: Optional[ThreadPoolExecutor], workers: int = 1):
+        """設定識別執行緒池，多張卡牌會分成 workers 份平行識別"""
+        self.recognition_pool = pool
+        self.recognition_workers = max(1, workers) if pool is not None else 1
+    
+    def recognize_card_faces(self, regions: List[np.ndarray]) -> List[RecognizedFaces]:
+        """識別多張卡牌的兩面，regions 依序為每張卡牌的上半部與旋轉後的下半部"""
+        card_count = len(regions) // 2
+        if self.recognition_pool is None or self.recognition_workers < 2 or card_count < 2:
+            return self._recognize_card_faces(regions)
+        
+        # 依工作執行緒數分批，每批仍以批次方式識別
+        cards_per_chunk = -(-card_count // self.recognition_workers)
+        chunks = [regions[i:i + 2 * cards_per_chunk] for i in range(0, len(regions), 2 * cards_per_chunk)]
+        faces = []
+        for chunk_faces in self.recognition_pool.map(self._recognize_card_faces, chunks):
+            faces.extend(chunk_faces)
+        return faces
+    
+    def _recognize_card_faces(self, regions: List[np.ndarray]) -> List[RecognizedFaces]:
+        # 所有半張卡牌一次完成符號匹配
+        with self.metrics.time("symbol_match"):
+            scores = self.symbol_matcher.score_regions(regions)
+            symbols = self.symbol_matcher.classify(scores)
+        
+        # 所有數值區域一次完成數字識別
+        with self.metrics.time("value_ocr"):
+            values = self.digit_recognizer.recognize_batch(regions)
+        
+        faces = []
+        for i in range(0, len(regions), 2):
+            # 沒有任何模板匹配（分數不為正）時符號只是預設值，視為沒有信心
+            confidence = min(values[i].confidence, values[i + 1].confidence,
+                             1.0 if symbols[i][1] > 0 else 0.0, 1.0 if symbols[i + 1][1] > 0 else 0.0)
+            faces.append(((symbols[i][0], values[i].value, symbols[i + 1][0], values[i + 1].value), confidence))
+        return faces
+    
     def has_card_at_position(self, card_image: np.ndarray) -> bool:
         """檢查指定位置是否有卡牌"""
         # 簡單的邊緣檢測來判斷是否有卡牌
-        gray = cv2.cvtColor(card_image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        return np.sum(edges) > 1000  # 閾值需要調整
-    
-    def flip_card(self, card: Card):
-        """翻轉卡牌（點擊卡牌中央區域）"""
-        pyautogui.click(card.center_position[0], card.center_position[1])
-        time.sleep(0.3)
-        card.current_side = "bottom" if card.current_side == "top" else "top"
-        print(f"翻轉卡牌到 {card.current_side} 面")
+        with self.metrics.time("has_card"):
+            gray = to_gray(card_image)
+            edges = cv2.Canny(gray, 50, 150)
+            return np.sum(edges) > 1000  # 閾值需要調整
     
-    def play_card(self, card: Card):
-        """打出卡牌（點擊卡牌非中央區域）"""
+    def card_rect(self, card: Card) -> Rect:
+        """卡牌在螢幕上的區域"""
+        card_width, card_height = card.size or self.card_size
+        return (card.position[0] - card_width // 2, card.position[1] - card_height // 2,
+                card_width, card_height)
+    
+    def play_point(self, card: Card) -> Tuple[int, int]:
+        """出牌的點擊位置"""
         # 點擊卡牌邊緣區域來出牌，避免中央切換區域
         offset_x = 25  # 偏移到卡牌邊緣
-        play_x = card.position[0] + offset_x
-        play_y = card.position[1]
-        
-        pyautogui.click(play_x, play_y)
-        time.sleep(0.3)
+        return (card.position[0] + offset_x, card.position[1])
+    
+    def flip_card(self, card: Card) -> bool:
+        """翻轉卡牌（點擊卡牌中央區域），回傳是否確認翻面"""
+        if not self.action_executor.click_and_confirm(card.center_position, self.card_rect(card)):
+            print(f"翻轉卡牌 {card.position} 失敗")
+            return False
+        self.card_flipped(card)
+        return True
+    
+    def play_card(self, card: Card) -> bool:
+        """打出卡牌（點擊卡牌非中央區域），回傳是否確認卡牌已離開手牌"""
+        if not self.action_executor.click_and_confirm(self.play_point(card), self.card_rect(card)):
+            print(f"打出卡牌 {card.position} 失敗")
+            return False
+        self.card_played(card)
+        return True
+    
+    def card_flipped(self, card: Card):
+        """翻面確認後更新卡牌與手牌模型"""
+        card.current_side = "bottom" if card.current_side == "top" else "top"
+        self.hand_tracker.apply_flip(card)
+        print(f"翻轉卡牌到 {card.current_side} 面")
+    
+    def card_played(self, card: Card):
+        """出牌確認後更新手牌模型"""
+        self.hand_tracker.apply_play(card)
         print(f"打出卡牌: {card.get_current_symbol().value} {card.get_current_value()}")
     
     def find_optimal_combination(self, target_symbol: CardSymbol, 
                                target_value: int, 
                                phase: GamePhase) -> List[Card]:
         """尋找最佳卡牌組合"""
-        available_cards = []
-        
-        # 根據階段篩選可用卡牌
-        for card in self.cards:
-            current_symbol = card.get_current_symbol()
-            if self.symbol_matches_phase(current_symbol, phase):
-                available_cards.append(card)
-        
-        # 也檢查翻面後的選項
-        for card in self.cards:
-            if card not in available_cards:
-                # 檢查翻面後是否符合條件
-                other_symbol = card.bottom_symbol if card.current_side == "top" else card.top_symbol
-                if self.symbol_matches_phase(other_symbol, phase):
-                    available_cards.append(card)
-        
-        # 動態規劃或貪心算法找最佳組合
+        # 根據階段篩選可用卡牌（目前面或翻面後符合階段）
+        available_cards = self.available_cards(phase)
+        
+        # 動態規劃找最佳組合
         return self.dp_card_combination(available_cards, target_symbol, target_value)
     
+    def available_cards(self, phase: GamePhase, cards: Optional[List[Card]] = None) -> List[Card]:
+        """目前面或翻面後符合階段的手牌（預設為 self.cards）"""
+        cards = self.cards if cards is None else cards
+        return [card for card in cards
+                if self.symbol_matches_phase(card.get_current_symbol(), phase)
+                or self.symbol_matches_phase(card.get_other_symbol(), phase)]
+    
+    def plan_requirements(self, requirements: List[Tuple[CardSymbol, int]],
+                          phase: GamePhase,
+                          cards: Optional[List[Card]] = None) -> List[RequirementPlan]:
+        """為階段的所有需求共同規劃出牌（每張卡牌只會被分配一次）"""
+        cards = self.cards if cards is None else cards
+        with self.metrics.time("solve"):
+            self.last_plans = self.plan_cache.get_or_solve(
+                cards, phase, requirements,
+                lambda: solve_phase_plan(self.available_cards(phase, cards), requirements))
+        return self.last_plans
+    
     def dp_card_combination(self, cards: List[Card], 
                           target_symbol: CardSymbol, 
                           target_value: int) -> List[Card]:
         """使用動態規劃找最佳卡牌組合"""
-        # 簡化版本：貪心算法
-        suitable_cards = []
-        
-        for card in cards:
-            current_symbol = card.get_current_symbol()
-            if current_symbol != target_symbol:
-                # 需要翻面
-                other_symbol = card.bottom_symbol if card.current_side == "top" else card.top_symbol
-                if other_symbol == target_symbol:
-                    suitable_cards.append((card, True))  # (卡牌, 需要翻面)
-            else:
-                suitable_cards.append((card, False))
-        
-        # 按數值排序，優先選擇高數值卡牌
-        suitable_cards.sort(key=lambda x: x[0].get_current_value() if not x[1] else 
-                          (x[0].bottom_value if x[0].current_side == "top" else x[0].top_value),
-                          reverse=True)
-        
-        selected_cards = []
-        current_sum = 0
-        
-        for card, need_flip in suitable_cards:
-            if need_flip:
-                value = card.bottom_value if card.current_side == "top" else card.top_value
-            else:
-                value = card.get_current_value()
-            
-            if current_sum + value <= target_value:
-                selected_cards.append(card)
-                current_sum += value
-                
-                if current_sum == target_value:
-                    break
-        
-        return selected_cards
+        requirements = [(target_symbol, target_value)]
+        with self.metrics.time("solve"):
+            plan = self.plan_cache.get_or_solve(cards, None, requirements,
+                                                lambda: solve_phase_plan(cards, requirements))[0]
+        return [play.card for play in plan.plays]
     
     def symbol_matches_phase(self, symbol: CardSymbol, phase: GamePhase) -> bool:
         """檢查符號是否符合階段需求"""
@@ -274,42 +2462,86 @@ class UnlightBot:
             return symbol in [CardSymbol.SHIELD, CardSymbol.SPECIAL]
         return False
     
-    def load_phase_requirements(self):
-        """從txt文件載入階段需求"""
+    def load_phase_requirements(self) -> bool:
+        """從txt文件載入階段需求，回傳是否成功
+
+        只有第一次載入且檔案不存在時才建立預設檔案；之後讀取或解析失敗時
+        保留目前的設定，不覆寫使用者的檔案。
+        """
+        first_load = self._requirements_mtime is None and not self.phase_requirements
         try:
-            with open('phase_requirements.txt', 'r', encoding='utf-8') as f:
+            with open(self.requirements_path, 'r', encoding='utf-8') as f:
+                mtime = os.fstat(f.fileno()).st_mtime
                 lines = f.readlines()
-                
-            current_phase = None
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                
-                if line.endswith('：') or line.endswith(':'):
-                    # 階段標題
-                    phase_name = line.rstrip('：:')
-                    if phase_name == "移動":
-                        current_phase = GamePhase.MOVE
-                    elif phase_name == "攻擊":
-                        current_phase = GamePhase.ATTACK
-                    elif phase_name == "防守":
-                        current_phase = GamePhase.DEFEND
-                    
-                    if current_phase:
-                        self.phase_requirements[current_phase] = []
-                
-                elif current_phase and ('移' in line or '劍' in line or '槍' in line or '盾' in line or '特' in line):
-                    # 解析需求，例如：移1 劍3
-                    requirements = self.parse_requirements(line)
-                    self.phase_requirements[current_phase].extend(requirements)
-                    
+            requirements = self.parse_requirement_lines(lines)
         except FileNotFoundError:
-            print("找不到 phase_requirements.txt 文件，將使用預設設定")
-            self.create_default_requirements_file()
+            if first_load:
+                print(f"找不到 {self.requirements_path} 文件，將使用預設設定")
+                self.create_default_requirements_file()
+                return True
+            self.requirements_error = "文件不存在"
+            print(f"找不到 {self.requirements_path} 文件，保留目前設定")
+            return False
         except Exception as e:
-            print(f"載入階段需求時出錯: {e}")
-            self.create_default_requirements_file()
+            self.requirements_error = str(e)
+            if first_load:
+                print(f"載入階段需求時出錯，暫時使用預設設定（不覆寫文件）: {e}")
+                self.phase_requirements = self.parse_requirement_lines(DEFAULT_REQUIREMENTS_TEXT.splitlines())
+            else:
+                print(f"載入階段需求時出錯，保留目前設定: {e}")
+            # 記下修改時間，檔案再次修改前不重複嘗試
+            try:
+                self._requirements_mtime = os.stat(self.requirements_path).st_mtime
+            except OSError:
+                pass
+            return False
+        
+        self.phase_requirements = requirements
+        self._requirements_mtime = mtime
+        self.requirements_error = None
+        return True
+    
+    def parse_requirement_lines(self, lines: List[str]) -> Dict[GamePhase, List[Tuple[CardSymbol, int]]]:
+        """解析需求文件的內容"""
+        phase_requirements = {}
+        current_phase = None
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            
+            if line.endswith('：') or line.endswith(':'):
+                # 階段標題
+                phase_name = line.rstrip('：:')
+                if phase_name == "移動":
+                    current_phase = GamePhase.MOVE
+                elif phase_name == "攻擊":
+                    current_phase = GamePhase.ATTACK
+                elif phase_name == "防守":
+                    current_phase = GamePhase.DEFEND
+                
+                if current_phase:
+                    phase_requirements[current_phase] = []
+            
+            elif current_phase and ('移' in line or '劍' in line or '槍' in line or '盾' in line or '特' in line):
+                # 解析需求，例如：移1 劍3
+                requirements = self.parse_requirements(line)
+                phase_requirements[current_phase].extend(requirements)
+        return phase_requirements
+    
+    def refresh_phase_requirements(self) -> bool:
+        """需求檔案的修改時間改變時重新載入，回傳是否重新載入成功"""
+        try:
+            mtime = os.stat(self.requirements_path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is None or mtime == self._requirements_mtime:
+            return False
+        if not self.load_phase_requirements():
+            return False
+        self.requirements_reloads += 1
+        print(f"已重新載入 {self.requirements_path}")
+        return True
     
     def parse_requirements(self, line: str) -> List[Tuple[CardSymbol, int]]:
         """解析需求字符串"""
@@ -346,25 +2578,10 @@ class UnlightBot:
     
     def create_default_requirements_file(self):
         """創建預設的需求配置文件"""
-        default_content = """# Unlight 階段需求配置
-# 格式：階段名稱：
-#       符號+數值 符號+數值
-# 符號：移(移動) 劍(劍) 槍(槍) 盾(盾牌) 特(特殊)
-
-移動：
-移1
-
-攻擊：
-劍3 特3
-
-防守：
-盾4
-"""
+        with open(self.requirements_path, 'w', encoding='utf-8') as f:
+            f.write(DEFAULT_REQUIREMENTS_TEXT)
         
-        with open('phase_requirements.txt', 'w', encoding='utf-8') as f:
-            f.write(default_content)
-        
-        print("已創建預設的 phase_requirements.txt 文件")
+        print(f"已創建預設的 {self.requirements_path} 文件")
         self.load_phase_requirements()
     
     def execute_phase_requirements(self, phase: GamePhase):
@@ -376,107 +2593,775 @@ class UnlightBot:
         requirements = self.phase_requirements[phase]
         print(f"執行階段 {phase.value} 需求: {requirements}")
         
-        for symbol, target_value in requirements:
-            optimal_cards = self.find_optimal_combination(symbol, target_value, phase)
-            
-            if not optimal_cards:
+        # 所有需求共同規劃，避免同一張卡牌被分配給兩個需求
+        plans = self.plan_requirements(requirements, phase)
+        self.execute_plans(plans)
+    
+    def compile_actions(self, plans: List[RequirementPlan]) -> Tuple[List[InputAction], List[InputAction]]:
+        """將規劃結果編譯成 (翻面序列, 出牌序列)
+
+        出牌由右到左排列：打出的卡牌離開後只有右側的卡牌會往前遞補，
+        因此尚未打出的卡牌位置在整個序列中都不會改變。
+        """
+        flips = []
+        plays = []
+        for plan_index, plan in enumerate(plans):
+            for play in plan.plays:
+                card = play.card
+                if play.flip:
+                    flips.append(InputAction("flip", card, card.center_position, self.card_rect(card), plan_index))
+                plays.append(InputAction("play", card, self.play_point(card), self.card_rect(card), plan_index))
+        plays.sort(key=lambda action: action.card.position[0], reverse=True)
+        return flips, plays
+    
+    def execute_plans(self, plans: List[RequirementPlan]):
+        """執行各需求的翻面與出牌（batch_actions 為 True 時以動作序列執行）"""
+        if self.batch_actions:
+            self.execute_plans_batched(plans)
+            return
+        
+        for plan in plans:
+            symbol, target_value = plan.symbol, plan.target
+            if not plan.plays:
                 print(f"沒有找到符合 {symbol.value} {target_value} 的卡牌組合")
                 continue
             
             total_value = 0
-            print(f"找到 {len(optimal_cards)} 張卡牌組合:")
+            print(f"找到 {len(plan.plays)} 張卡牌組合:")
             
-            # 翻轉需要翻面的卡牌
-            for card in optimal_cards:
-                current_symbol = card.get_current_symbol()
-                if current_symbol != symbol:
-                    print(f"  翻轉卡牌 {card.position} 從 {current_symbol.value} 到 {symbol.value}")
-                    self.flip_card(card)
-                    time.sleep(0.2)
+            # 翻轉需要翻面的卡牌（翻面失敗時放棄此需求）
+            flipped = True
+            for play in plan.plays:
+                if play.flip:
+                    card = play.card
+                    print(f"  翻轉卡牌 {card.position} 從 {card.get_current_symbol().value} 到 {symbol.value}")
+                    if not self.flip_card(card):
+                        flipped = False
+                        break
+            if not flipped:
+                print(f"放棄需求: {symbol.value} {target_value}")
+                continue
             
             # 打出卡牌
-            for card in optimal_cards:
+            for play in plan.plays:
+                card = play.card
                 current_value = card.get_current_value()
-                total_value += current_value
                 print(f"  打出: {card.get_current_symbol().value} {current_value}")
-                self.play_card(card)
-                time.sleep(0.5)
+                if self.play_card(card):
+                    total_value += current_value
             
             print(f"完成需求: {symbol.value} 總計 {total_value}/{target_value}")
-            time.sleep(1)
+    
+    def execute_plans_batched(self, plans: List[RequirementPlan]):
+        """先連續翻面、確認後再連續出牌；翻面失敗的需求不出牌"""
+        for plan in plans:
+            if not plan.plays:
+                print(f"沒有找到符合 {plan.symbol.value} {plan.target} 的卡牌組合")
+        flips, plays = self.compile_actions(plans)
+        if not plays:
+            return
+        
+        abandoned = set()
+        for action, confirmed in zip(flips, self.action_executor.run_sequence(flips)):
+            if confirmed:
+                self.card_flipped(action.card)
+            else:
+                print(f"翻轉卡牌 {action.card.position} 失敗")
+                abandoned.add(action.plan_index)
+        for plan_index in sorted(abandoned):
+            print(f"放棄需求: {plans[plan_index].symbol.value} {plans[plan_index].target}")
+        
+        plays = [action for action in plays if action.plan_index not in abandoned]
+        totals = [0] * len(plans)
+        for action, confirmed in zip(plays, self.action_executor.run_sequence(plays)):
+            if confirmed:
+                totals[action.plan_index] += action.card.get_current_value()
+                self.card_played(action.card)
+            else:
+                print(f"打出卡牌 {action.card.position} 失敗")
+        
+        for plan_index, plan in enumerate(plans):
+            if plan.plays and plan_index not in abandoned:
+                print(f"完成需求: {plan.symbol.value} 總計 {totals[plan_index]}/{plan.target}")
     
     def execute_turn(self, target_symbol: CardSymbol = None, target_value: int = None):
-        """執行一回合"""
+        """執行一回合（畫面來源結束時回傳 False）"""
+        # 擷取一次畫面，掃描手牌與檢測階段共用
+        frame = self.grab_frame()
+        if frame is None:
+            print("畫面來源已結束")
+            return False
+        
         # 1. 掃描手牌
-        self.cards = self.scan_hand_cards()
+        if self.track_hand_state:
+            self.cards = self.hand_tracker.sync(frame)
+        else:
+            self.cards = self.scan_hand_cards(frame)
         print(f"掃描到 {len(self.cards)} 張手牌")
         
         # 2. 檢測當前階段
-        image = self.capture_screen()
-        self.current_phase = self.detect_game_phase(image)
+        self.current_phase = self.detect_game_phase(frame)
         print(f"當前階段: {self.current_phase.value}")
         
+        if self.recorder is not None:
+            self.recorder.record_frame(frame, self.capture_rois(), self.cards,
+                                       self.current_phase, self.phase_confidence)
+            self._recorded_frame = frame.index
+        
         # 3. 如果沒有指定目標，使用配置文件的需求
         if target_symbol is None or target_value is None:
             self.execute_phase_requirements(self.current_phase)
-            return
+            return True
         
         # 4. 使用指定的目標
-        optimal_cards = self.find_optimal_combination(target_symbol, target_value, self.current_phase)
+        plan = self.plan_requirements([(target_symbol, target_value)], self.current_phase)[0]
         
-        if not optimal_cards:
+        if not plan.plays:
             print("沒有找到合適的卡牌組合")
-            return
+            return True
         
-        print(f"找到 {len(optimal_cards)} 張卡牌組合")
+        print(f"找到 {len(plan.plays)} 張卡牌組合")
         
         # 5. 翻轉需要翻面的卡牌
-        for card in optimal_cards:
-            current_symbol = card.get_current_symbol()
-            if current_symbol != target_symbol:
-                print(f"翻轉卡牌 {card.position}")
-                self.flip_card(card)
+        for play in plan.plays:
+            if play.flip:
+                print(f"翻轉卡牌 {play.card.position}")
+                if not self.flip_card(play.card):
+                    return True
         
         # 6. 打出卡牌
-        for card in optimal_cards:
-            print(f"打出卡牌 {card.position}")
-            self.play_card(card)
-            time.sleep(0.5)
+        for play in plan.plays:
+            print(f"打出卡牌 {play.card.position}")
+            self.play_card(play.card)
+        
+        return True
+    
+    def run_tick(self) -> bool:
+        """執行一回合並記錄耗時；profile_next_tick 為 True 時以 cProfile 分析"""
+        self.refresh_phase_requirements()
+        self.metrics.take_current()
+        self.last_plans = []
+        self._recorded_frame = None
+        
+        if not self.profile_next_tick:
+            with self.metrics.time("tick"):
+                result = self.execute_turn()
+        else:
+            self.profile_next_tick = False
+            profiler = cProfile.Profile()
+            with self.metrics.time("tick"):
+                result = profiler.runcall(self.execute_turn)
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(20)
+            print(output.getvalue())
+            profiler.dump_stats("tick.prof")
+            print("已輸出 tick.prof")
+        
+        if self.recorder is not None and self._recorded_frame is not None:
+            self.recorder.record_decision(self._recorded_frame, self.last_plans, self.metrics.take_current())
+        return result
     
-    def run_auto_play(self):
-        """自動遊戲主循環"""
+    def run_auto_play(self, pipelined: bool = False, workers: int = 2,
+                      metrics_path: Optional[str] = None,
+                      record_path: Optional[str] = None,
+                      plan_cache_path: Optional[str] = None):
+        """自動遊戲主循環（pipelined=True 時使用多執行緒管線）
+
+        結束時輸出各階段耗時摘要，指定 metrics_path 時另外匯出 JSON/CSV。
+        指定 record_path 時將每回合的畫面區域、識別結果、計畫與耗時附加到錄製檔
+        （可用 SessionReplayer 離線回放；管線模式不錄製）。
+        指定 plan_cache_path 時計畫快取會從該檔案載入並在結束時寫回。
+        """
+        if plan_cache_path:
+            self.plan_cache = PlanCache(path=plan_cache_path)
+        if record_path and not pipelined:
+            self.recorder = SessionRecorder(record_path)
+            print(f"錄製對局到 {record_path}")
+        
         print("開始自動遊戲...")
         print("階段需求配置:")
         for phase, requirements in self.phase_requirements.items():
             print(f"  {phase.value}: {[(r[0].value, r[1]) for r in requirements]}")
         
+        try:
+            if pipelined:
+                PipelinedRuntime(self, workers=workers).run()
+                return
+            
+            while True:
+                try:
+                    # 根據配置文件執行每個階段
+                    if not self.run_tick():
+                        break
+                    self.metrics.maybe_print_summary()
+                    time.sleep(2)
+                    
+                except KeyboardInterrupt:
+                    print("停止自動遊戲")
+                    break
+                except Exception as e:
+                    print(f"錯誤: {e}")
+                    time.sleep(1)
+        finally:
+            self.metrics.print_summary()
+            if metrics_path:
+                self.metrics.dump(metrics_path)
+                print(f"已匯出耗時統計: {metrics_path}")
+            stats = self.plan_cache.stats()
+            print(f"計畫快取: 命中 {stats['hits']} 次、未命中 {stats['misses']} 次，"
+                  f"約省下 {stats['saved_ms']:.1f} ms 求解時間")
+            self.plan_cache.save()
+            if self.recorder is not None:
+                self.recorder.close()
+                print(f"已錄製 {self.recorder.frames_recorded} 張畫面（捨棄 {self.recorder.dropped} 筆）")
+                self.recorder = None
+
+@dataclass
+class TurnDecision:
+    """識別階段對一張畫面做出的決策"""
+    generation: int  # 擷取畫面時的動作世代，執行前若已改變代表畫面已過時
+    frame_index: int
+    cards: List[Card]
+    phase: GamePhase
+    plans: List[RequirementPlan]
+
+class PipelinedRuntime:
+    """管線化的自動遊戲執行環境
+
+    擷取執行緒 → 識別（執行緒池平行識別卡牌）→ 動作執行緒，
+    各階段以有限大小的佇列串接（佇列滿時上游會等待）。
+    畫面以「動作世代」標記：動作開始前、執行期間與動作後等待 turn_interval
+    期間擷取的畫面都會被捨棄，動作執行緒只會使用等待結束後才擷取的畫面，
+    與主循環「等待後重新擷取」的順序相同。
+    """
+    def __init__(self, bot: UnlightBot,
+                 workers: int = 2,
+                 queue_size: int = 2,
+                 capture_interval: float = 0.05,
+                 turn_interval: float = 2.0):
+        self.bot = bot
+        self.workers = workers
+        self.capture_interval = capture_interval  # 兩次擷取之間的最短間隔（秒）
+        self.turn_interval = turn_interval  # 執行動作後的等待（與主循環相同）
+        self.frames: "queue.Queue[Optional[Tuple[int, Frame]]]" = queue.Queue(maxsize=queue_size)
+        self.decisions: "queue.Queue[Optional[TurnDecision]]" = queue.Queue(maxsize=1)
+        self.stop_event = threading.Event()
+        self.generation = 0
+        self._generation_lock = threading.Lock()
+        self.frames_captured = 0
+        self.decisions_made = 0
+        self.decisions_dropped = 0
+    
+    def _put(self, target: queue.Queue, item) -> bool:
+        """放入佇列（佇列滿時等待），停止時回傳 False"""
+        while not self.stop_event.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, source: queue.Queue):
+        """從佇列取出，停止時拋出 queue.Empty"""
+        while not self.stop_event.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise queue.Empty
+    
+    def _bump_generation(self):
+        with self._generation_lock:
+            self.generation += 1
+    
+    def capture_loop(self):
+        """擷取執行緒：持續擷取畫面"""
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            generation = self.generation
+            frame = self.bot.grab_frame()
+            if frame is None:
+                print("畫面來源已結束")
+                self._put(self.frames, None)
+                return
+            # 畫面來源會重複使用緩衝區，放入佇列前先複製
+            frame = Frame([(rect, array.copy()) for rect, array in frame.regions],
+                          frame.index, frame.timestamp, frame.is_full)
+            self.frames_captured += 1
+            if not self._put(self.frames, (generation, frame)):
+                return
+            elapsed = time.monotonic() - started
+            if elapsed < self.capture_interval:
+                time.sleep(self.capture_interval - elapsed)
+    
+    def recognize_loop(self):
+        """識別執行緒：掃描手牌、判斷階段並規劃出牌"""
         while True:
             try:
-                # 根據配置文件執行每個階段
-                self.execute_turn()
-                time.sleep(2)
-                
-            except KeyboardInterrupt:
-                print("停止自動遊戲")
-                break
+                item = self._get(self.frames)
+            except queue.Empty:
+                return
+            if item is None:
+                self._put(self.decisions, None)
+                return
+            generation, frame = item
+            if generation != self.generation:
+                self.decisions_dropped += 1
+                continue
+            try:
+                with self.bot.metrics.time("decide"):
+                    cards = self.bot.scan_hand_cards(frame)
+                    phase = self.bot.detect_game_phase(frame)
+                    requirements = self.bot.phase_requirements.get(phase, [])
+                    plans = self.bot.plan_requirements(requirements, phase, cards)
             except Exception as e:
-                print(f"錯誤: {e}")
-                time.sleep(1)
+                print(f"識別錯誤: {e}")
+                continue
+            self.decisions_made += 1
+            self.bot.metrics.maybe_print_summary()
+            if not self._put(self.decisions, TurnDecision(generation, frame.index, cards, phase, plans)):
+                return
+    
+    def action_loop(self):
+        """動作執行緒：執行最新且未過時的決策"""
+        while True:
+            try:
+                decision = self._get(self.decisions)
+            except queue.Empty:
+                return
+            if decision is None:
+                self.stop_event.set()
+                return
+            if decision.generation != self.generation:
+                self.decisions_dropped += 1
+                continue
+            if not any(plan.plays for plan in decision.plans):
+                continue
+            
+            # 動作開始時與動作後的等待結束時都推進世代，
+            # 期間擷取的畫面（包含動畫進行中的畫面）都會被捨棄
+            self._bump_generation()
+            try:
+                self.bot.cards = decision.cards
+                self.bot.current_phase = decision.phase
+                print(f"畫面 {decision.frame_index}: 階段 {decision.phase.value}，{len(decision.cards)} 張手牌")
+                self.bot.execute_plans(decision.plans)
+            except Exception as e:
+                print(f"動作錯誤: {e}")
+            if self.stop_event.wait(self.turn_interval):
+                return
+            self._bump_generation()
+    
+    def run(self):
+        """啟動管線並等待結束（Ctrl+C 時乾淨地停止所有執行緒）"""
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="recognize")
+        previous_pool = (self.bot.recognition_pool, self.bot.recognition_workers)
+        self.bot.set_recognition_pool(pool, self.workers)
+        threads = [
+            threading.Thread(target=self.capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self.recognize_loop, name="recognize", daemon=True),
+            threading.Thread(target=self.action_loop, name="action", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.2)
+        except KeyboardInterrupt:
+            print("停止自動遊戲")
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join(timeout=2.0)
+            self.bot.set_recognition_pool(*previous_pool)
+            pool.shutdown(wait=True)
+            print(f"擷取 {self.frames_captured} 張畫面，決策 {self.decisions_made} 次，"
+                  f"捨棄過時畫面 {self.decisions_dropped} 次")
 
-# 使用示例
-if __name__ == "__main__":
-    bot = UnlightBot()
+class InputScheduler:
+    """輸入排程器 - 以單一執行緒依序執行所有工作階段的點擊
+
+    每個工作階段有自己的佇列，排程器輪流從各佇列取出一個點擊執行，
+    避免多個工作階段同時搶用滑鼠，也不會讓某個工作階段獨佔。
+    各工作階段透過 backend_for() 取得的輸入後端送出點擊，
+    實際點擊與等待都由 input_backend 執行。
+    """
+    def __init__(self, input_backend: Optional[InputBackend] = None,
+                 min_interval: float = 0.0):
+        self.input_backend = input_backend or PyAutoGUIBackend()
+        self.min_interval = min_interval  # 兩次點擊之間的最短間隔（秒）
+        self.clicks = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._next = 0
     
-    # 手動執行單次操作（使用配置文件）
-    # bot.execute_turn()
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="input", daemon=True)
+        self._thread.start()
     
-    # 手動執行單次操作（指定目標）
-    # bot.execute_turn(CardSymbol.MOVE, 3)
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+    
+    def submit(self, session: str, x: int, y: int) -> bool:
+        """加入點擊並等待執行完成，回傳是否成功"""
+        request = {"point": (x, y), "done": threading.Event(), "ok": False}
+        with self._condition:
+            if self._stopped:
+                return False
+            self._queues.setdefault(session, deque()).append(request)
+            self._condition.notify_all()
+        request["done"].wait()
+        return request["ok"]
+    
+    def backend_for(self, session: str) -> "ScheduledInputBackend":
+        """取得給該工作階段的 ActionExecutor 使用的輸入後端"""
+        return ScheduledInputBackend(self, session)
     
-    # 開始自動遊戲（使用配置文件）
-    # bot.run_auto_play()
+    def _next_request(self) -> Optional[dict]:
+        """輪流從各工作階段的佇列取出下一個點擊（需持有鎖）"""
+        names = list(self._queues)
+        for offset in range(len(names)):
+            name = names[(self._next + offset) % len(names)]
+            if self._queues[name]:
+                self._next = (self._next + offset + 1) % len(names)
+                return self._queues[name].popleft()
+        return None
     
-    # 測試掃描手牌
+    def _run(self):
+        while True:
+            with self._condition:
+                request = self._next_request()
+                while request is None and not self._stopped:
+                    self._condition.wait()
+                    request = self._next_request()
+                if request is None:
+                    # 停止時讓仍在等待的點擊返回
+                    for pending in self._queues.values():
+                        for item in pending:
+                            item["done"].set()
+                        pending.clear()
+                    return
+            try:
+                self.input_backend.click(*request["point"])
+                request["ok"] = True
+                self.clicks += 1
+            except Exception as e:
+                print(f"點擊錯誤: {e}")
+            finally:
+                request["done"].set()
+            self.input_backend.wait(self.min_interval)
+
+class ScheduledInputBackend(InputBackend):
+    """將點擊交給 InputScheduler 排程的輸入後端（等待點擊實際執行後才返回）"""
+    def __init__(self, scheduler: InputScheduler, session: str):
+        self.scheduler = scheduler
+        self.session = session
+    
+    def click(self, x: int, y: int):
+        if not self.scheduler.submit(self.session, x, y):
+            raise RuntimeError(f"工作階段 {self.session} 的點擊未執行")
+    
+    def wait(self, seconds: float):
+        self.scheduler.input_backend.wait(seconds)
+
+class GameSession:
+    """多開模式中的單一遊戲視窗"""
+    def __init__(self, name: str, bot: UnlightBot):
+        self.name = name
+        self.bot = bot
+        self.ticks = 0
+        self.thread: Optional[threading.Thread] = None
+
+class MultiSessionController:
+    """多開控制器 - 在同一個程序中操作多個遊戲視窗
+
+    所有工作階段共用模板庫、數字識別器與識別執行緒池，
+    點擊則全部交由 InputScheduler 依序、公平地執行。
+    每個工作階段可以指定視窗區域，或直接提供畫面來源（例如回放）。
+    """
+    def __init__(self, workers: Optional[int] = None,
+                 turn_interval: float = 2.0,
+                 input_backend: Optional[InputBackend] = None):
+        self.workers = workers or os.cpu_count() or 2
+        self.turn_interval = turn_interval  # 每個工作階段兩回合之間的等待（與主循環相同）
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="recognize")
+        self.scheduler = InputScheduler(input_backend)
+        self.plan_cache = PlanCache()  # 所有工作階段共用
+        self.sessions: List[GameSession] = []
+        self.stop_event = threading.Event()
+    
+    def add_session(self, name: str, window: Optional[Rect] = None,
+                    frame_source: Optional[FrameSource] = None) -> GameSession:
+        """加入工作階段；window 為遊戲視窗在螢幕上的區域 (x, y, 寬, 高)"""
+        if frame_source is None:
+            frame_source = ScreenFrameSource(window=window)
+        bot = UnlightBot(frame_source, input_backend=self.scheduler.backend_for(name))
+        bot.set_recognition_pool(self.pool, self.workers)
+        bot.plan_cache = self.plan_cache
+        if window is not None:
+            bot.action_executor.origin = (window[0], window[1])
+        session = GameSession(name, bot)
+        self.sessions.append(session)
+        return session
+    
+    def _session_loop(self, session: GameSession):
+        while not self.stop_event.is_set():
+            try:
+                if not session.bot.run_tick():
+                    return
+                session.ticks += 1
+            except Exception as e:
+                print(f"[{session.name}] 錯誤: {e}")
+            if self.stop_event.wait(self.turn_interval):
+                return
+    
+    def run(self):
+        """啟動所有工作階段並等待結束（Ctrl+C 時停止所有工作階段）"""
+        self.scheduler.start()
+        for session in self.sessions:
+            session.thread = threading.Thread(target=self._session_loop, args=(session,),
+                                              name=f"session-{session.name}", daemon=True)
+            session.thread.start()
+        try:
+            while any(session.thread.is_alive() for session in self.sessions):
+                for session in self.sessions:
+                    session.thread.join(timeout=0.2)
+        except KeyboardInterrupt:
+            print("停止所有工作階段")
+        finally:
+            self.stop_event.set()
+            for session in self.sessions:
+                session.thread.join(timeout=2.0)
+            self.scheduler.stop()
+            self.pool.shutdown(wait=True)
+            for session in self.sessions:
+                print(f"[{session.name}] 執行 {session.ticks} 回合")
+            print(f"共點擊 {self.scheduler.clicks} 次")
+
+# 控制 socket 的預設位址：支援 Unix socket 時為暫存資料夾中的檔案，否則為本機 TCP 埠
+DEFAULT_CONTROL_ADDRESS = (os.path.join(tempfile.gettempdir(), "unlight_bot.sock")
+                           if hasattr(socket, "AF_UNIX") else "127.0.0.1:47613")
+
+def parse_control_address(address: str) -> Tuple[int, Union[str, Tuple[str, int]]]:
+    """將控制位址轉換為 (socket family, 位址)；"主機:埠" 為 TCP，其餘為 Unix socket 路徑"""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+def send_command(command: str, address: str = DEFAULT_CONTROL_ADDRESS,
+                 timeout: float = 30.0) -> dict:
+    """傳送一個指令給常駐程序並回傳回應"""
+    family, target = parse_control_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(target)
+        client.sendall(json.dumps({"command": command}).encode('utf-8') + b"\n")
+        with client.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("常駐程序沒有回應")
+    return json.loads(line)
+
+def plan_summary(plan: RequirementPlan) -> dict:
+    """計畫的摘要（卡牌以完整內容表示）"""
+    return {
+        "symbol": plan.symbol.name,
+        "target": plan.target,
+        "total": plan.total,
+        "plays": [{"card": play.card.to_dict(), "flip": play.flip, "value": play.value} for play in plan.plays],
+    }
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """每行一個 JSON 請求，回應一行 JSON"""
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.daemon.handle(request.get("command", ""))
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
+            self.wfile.flush()
+            if self.server.daemon.shutdown_requested:
+                # shutdown() 會等待 serve_forever 結束，需要在其他執行緒中呼叫
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+class BotDaemon:
+    """常駐模式 - 啟動一次後讓模板、識別器與需求設定保持在記憶體中
+
+    透過本機控制 socket 接受指令（scan、execute_turn、start、stop、stats、
+    reload、shutdown）。phase_requirements.txt 的修改時間改變時自動重新載入。
+    所有操作 bot 的指令與自動遊戲迴圈以同一把鎖依序執行。
+    """
+    COMMANDS = ("scan", "execute_turn", "start", "stop", "stats", "reload", "shutdown")
+
+    def __init__(self, bot: UnlightBot, address: str = DEFAULT_CONTROL_ADDRESS,
+                 turn_interval: float = 2.0, reload_interval: float = 1.0):
+        self.bot = bot
+        self.address = address
+        self.turn_interval = turn_interval  # 自動遊戲兩回合之間的等待（與主循環相同）
+        self.reload_interval = reload_interval  # 閒置時檢查需求檔案的間隔（秒）
+        self.started_at = time.time()
+        self._bot_lock = threading.Lock()
+        self._auto_stop = threading.Event()
+        self._auto_thread: Optional[threading.Thread] = None
+        self._server: Optional[socketserver.BaseServer] = None
+        self.shutdown_requested = False
+    
+    @property
+    def auto_playing(self) -> bool:
+        return self._auto_thread is not None and self._auto_thread.is_alive()
+    
+    def _create_server(self) -> socketserver.BaseServer:
+        family, target = parse_control_address(self.address)
+        daemon = self
+        
+        if family == socket.AF_INET:
+            base = socketserver.ThreadingTCPServer
+        else:
+            base = socketserver.ThreadingUnixStreamServer
+            if os.path.exists(target):
+                os.unlink(target)  # 上次未正常結束留下的 socket 檔案
+        
+        class Server(base):
+            daemon_threads = True
+            allow_reuse_address = True
+            
+            def service_actions(self):
+                # serve_forever 每次輪詢時檢查需求檔案（正在執行回合時略過）
+                if daemon._bot_lock.acquire(blocking=False):
+                    try:
+                        daemon.bot.refresh_phase_requirements()
+                    finally:
+                        daemon._bot_lock.release()
+        
+        server = Server(target, _ControlHandler)
+        server.daemon = self
+        return server
+    
+    def serve_forever(self):
+        """啟動控制 socket，直到收到 shutdown 或 Ctrl+C"""
+        self._server = self._create_server()
+        print(f"常駐程序已啟動，控制位址: {self.address}")
+        try:
+            self._server.serve_forever(poll_interval=self.reload_interval)
+        except KeyboardInterrupt:
+            print("停止常駐程序")
+        finally:
+            self.stop_auto_play()
+            self._server.server_close()
+            family, target = parse_control_address(self.address)
+            if family != socket.AF_INET and os.path.exists(target):
+                os.unlink(target)
+    
+    def handle(self, command: str) -> dict:
+        """執行一個控制指令"""
+        if command not in self.COMMANDS:
+            return {"ok": False, "error": f"未知的指令: {command}（可用: {', '.join(self.COMMANDS)}）"}
+        return {"ok": True, "result": getattr(self, f"_command_{command}")()}
+    
+    def _command_scan(self) -> dict:
+        with self._bot_lock:
+            bot = self.bot
+            bot.refresh_phase_requirements()
+            frame = bot.grab_frame()
+            if frame is None:
+                raise RuntimeError("畫面來源已結束")
+            cards = bot.hand_tracker.sync(frame) if bot.track_hand_state else bot.scan_hand_cards(frame)
+            phase = bot.detect_game_phase(frame)
+            return {"phase": phase.name, "phase_confidence": bot.phase_confidence,
+                    "cards": [card.to_dict() for card in cards]}
+    
+    def _command_execute_turn(self) -> dict:
+        if self.auto_playing:
+            raise RuntimeError("自動遊戲執行中，請先 stop")
+        with self._bot_lock:
+            continued = self.bot.run_tick()
+            return {"continued": continued, "phase": self.bot.current_phase.name,
+                    "plans": [plan_summary(plan) for plan in self.bot.last_plans]}
+    
+    def _auto_play_loop(self):
+        while not self._auto_stop.is_set():
+            try:
+                with self._bot_lock:
+                    if not self.bot.run_tick():
+                        return
+                self.bot.metrics.maybe_print_summary()
+            except Exception as e:
+                print(f"錯誤: {e}")
+            if self._auto_stop.wait(self.turn_interval):
+                return
+    
+    def _command_start(self) -> dict:
+        if not self.auto_playing:
+            self._auto_stop.clear()
+            self._auto_thread = threading.Thread(target=self._auto_play_loop, name="auto-play", daemon=True)
+            self._auto_thread.start()
+        return {"auto_play": True}
+    
+    def stop_auto_play(self):
+        self._auto_stop.set()
+        if self._auto_thread is not None:
+            self._auto_thread.join()
+            self._auto_thread = None
+    
+    def _command_stop(self) -> dict:
+        self.stop_auto_play()
+        return {"auto_play": False}
+    
+    def _command_stats(self) -> dict:
+        bot = self.bot
+        return {
+            "uptime": time.time() - self.started_at,
+            "auto_play": self.auto_playing,
+            "metrics": bot.metrics.summary(),
+            "plan_cache": bot.plan_cache.stats(),
+            "recognition_cache": {"hits": bot.recognition_cache.hits, "misses": bot.recognition_cache.misses},
+            "hand_tracker": {"full_scans": bot.hand_tracker.full_scans,
+                             "verified_syncs": bot.hand_tracker.verified_syncs},
+            "requirements": {phase.name: [[symbol.name, value] for symbol, value in requirements]
+                             for phase, requirements in bot.phase_requirements.items()},
+            "requirements_reloads": bot.requirements_reloads,
+        }
+    
+    def _command_reload(self) -> dict:
+        with self._bot_lock:
+            if not self.bot.load_phase_requirements():
+                raise RuntimeError(f"重新載入失敗，保留目前設定: {self.bot.requirements_error}")
+            self.bot.requirements_reloads += 1
+        return {"requirements_reloads": self.bot.requirements_reloads}
+    
+    def _command_shutdown(self) -> dict:
+        # 回應送出後才停止控制 socket
+        self.shutdown_requested = True
+        return {"shutdown": True}
+
+# 使用示例
+def create_bot(replay: Optional[str] = None, dry_run: bool = False) -> UnlightBot:
+    """依命令列選項建立 bot：replay 為錄製檔 (.rec)、截圖資料夾或影片，dry_run 時只記錄點擊"""
+    frame_source = None
+    if replay:
+        frame_source = RecordedFrameSource(replay) if replay.endswith(".rec") else ReplayFrameSource(replay)
+    bot = UnlightBot(frame_source, input_backend=RecordingInputBackend() if dry_run else None)
+    if replay:
+        # 回放的畫面不會因點擊而改變，縮短確認等待
+        bot.action_executor.timeout = 0.05
+        bot.action_executor.retries = 0
+    return bot
+
+def show_hand(bot: UnlightBot):
+    """掃描並顯示手牌與目前的階段需求配置"""
     cards = bot.scan_hand_cards()
     for i, card in enumerate(cards):
         print(f"卡牌 {i+1}: 位置{card.position}, 中央{card.center_position}")
@@ -487,4 +3372,58 @@ if __name__ == "__main__":
     # 顯示當前配置
     print("\n當前階段需求配置:")
     for phase, requirements in bot.phase_requirements.items():
-        print(f"{phase.value}: {[(r[0].value, r[1]) for r in requirements]}")
\ No newline at end of file
+        print(f"{phase.value}: {[(r[0].value, r[1]) for r in requirements]}")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Unlight 自動化")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    def add_bot_options(subparser: argparse.ArgumentParser):
+        subparser.add_argument("--replay", help="以錄製檔 (.rec)、截圖資料夾或影片取代螢幕擷取")
+        subparser.add_argument("--dry-run", action="store_true", help="只記錄點擊，不移動滑鼠")
+    
+    scan = subparsers.add_parser("scan", help="掃描手牌並顯示需求配置（預設）")
+    add_bot_options(scan)
+    
+    run = subparsers.add_parser("run", help="開始自動遊戲")
+    add_bot_options(run)
+    run.add_argument("--pipelined", action="store_true", help="使用多執行緒管線")
+    run.add_argument("--workers", type=int, default=2)
+    run.add_argument("--metrics", help="結束時匯出耗時統計（.json 或 .csv）")
+    run.add_argument("--record", help="錄製對局到此檔案")
+    run.add_argument("--plan-cache", help="計畫快取檔案（啟動時載入、結束時寫回）")
+    
+    daemon = subparsers.add_parser("daemon", help="常駐模式，透過控制 socket 接受指令")
+    add_bot_options(daemon)
+    daemon.add_argument("--socket", default=DEFAULT_CONTROL_ADDRESS, help="Unix socket 路徑或 主機:埠")
+    
+    ctl = subparsers.add_parser("ctl", help="傳送指令給常駐程序")
+    ctl.add_argument("action", choices=BotDaemon.COMMANDS)
+    ctl.add_argument("--socket", default=DEFAULT_CONTROL_ADDRESS, help="Unix socket 路徑或 主機:埠")
+    
+    args = parser.parse_args(argv)
+    
+    # 控制指令只需要 socket，不載入 OpenCV、numpy 與 pyautogui
+    if args.command == "ctl":
+        response = send_command(args.action, args.socket)
+        print(json.dumps(response, ensure_ascii=False, indent=2))
+        if not response.get("ok"):
+            raise SystemExit(1)
+        return
+    
+    bot = create_bot(getattr(args, "replay", None), getattr(args, "dry_run", False))
+    if args.command == "run":
+        bot.run_auto_play(pipelined=args.pipelined, workers=args.workers, metrics_path=args.metrics,
+                          record_path=args.record, plan_cache_path=args.plan_cache)
+    elif args.command == "daemon":
+        BotDaemon(bot, args.socket).serve_forever()
+    else:
+        show_hand(bot)
+
+if __name__ == "__main__":
+    # 手動執行單次操作（使用配置文件）
+    # UnlightBot().execute_turn()
+    
+    # 手動執行單次操作（指定目標）
+    # UnlightBot().execute_turn(CardSymbol.MOVE, 3)
+    main()